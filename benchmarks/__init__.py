@@ -0,0 +1,9 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import os
+import tempfile
+
+# Benchmarks track thousands of made up packages, keep them out of the real package list and cache
+# (this has to happen before anything imports usps.storage, which opens the database right away)
+os.environ["HOME"] = os.environ["USERPROFILE"] = tempfile.mkdtemp(prefix = "usps-benchmarks-")
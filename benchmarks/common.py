@@ -0,0 +1,99 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from dataclasses import asdict, dataclass
+from collections.abc import Callable
+
+from usps.tracking.numbers import mod10_checksum, ups_checksum
+
+# Fixtures
+FIXTURES = Path(__file__).parent / "fixtures"
+PLACEHOLDER = "{{tracking_number}}"
+
+def load_fixtures(carrier: str) -> dict[str, str]:
+    return {file.stem: file.read_text() for file in sorted((FIXTURES / carrier).iterdir())}
+
+def fill(fixture: str, tracking_number: str) -> str:
+    return fixture.replace(PLACEHOLDER, tracking_number)
+
+# Tracking numbers that pass check digit validation
+def usps_numbers(count: int, offset: int = 0) -> list[str]:
+    numbers = []
+    for index in range(offset, offset + count):
+        body = f"9400100000{index:011d}"
+        numbers.append(next(body + digit for digit in "0123456789" if mod10_checksum(body + digit)))
+
+    return numbers
+
+def ups_numbers(count: int, offset: int = 0) -> list[str]:
+    numbers = []
+    for index in range(offset, offset + count):
+        body = f"1Z999AA1{index:09d}"
+        numbers.append(next(body + digit for digit in "0123456789" if ups_checksum(body + digit)))
+
+    return numbers
+
+NUMBERS = {"USPS": usps_numbers, "UPS": ups_numbers}
+
+# Measurements
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else 0
+
+def peak_memory(function: Callable[[], object]) -> float:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+
+    finally:
+        tracemalloc.stop()
+
+@dataclass
+class Result:
+    name:       str
+    items:      int             # Whatever got processed: packages, requests or pages
+    elapsed:    float           # Wall clock seconds for the whole benchmark
+    samples:    list[float]     # Seconds per sample, a sample being one call or one whole batch
+    memory:     float | None    # Peak traced memory in MiB, measured in a separate run
+    errors:     int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.elapsed if self.elapsed else 0
+
+    def to_dict(self) -> dict:
+        return asdict(self) | {
+            "samples": len(self.samples),
+            "throughput": self.throughput,
+            "p50": percentile(self.samples, 0.5),
+            "p99": percentile(self.samples, 0.99)
+        }
+
+# The function returns how many of its items failed, memory is measured in one extra run
+# since tracemalloc slows everything else down
+def measure(name: str, items: int, rounds: int, function: Callable[[], int], memory: bool = True) -> Result:
+    samples, errors = [], 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        errors += function()
+        samples.append(time.perf_counter() - start)
+
+    return Result(name, items * rounds, sum(samples), samples, peak_memory(function) if memory else None, errors)
+
+def report(results: list[Result], as_json: bool = False, unit: str = "items") -> None:
+    if as_json:
+        return print(json.dumps([result.to_dict() for result in results], indent = 4))
+
+    width = max(len(result.name) for result in results)
+    print(f"{'benchmark':<{width}}  {unit + '/s':>12}  {'p50 ms':>10}  {'p99 ms':>10}  {'peak MiB':>9}  {'errors':>6}")
+    for result in results:
+        memory = f"{result.memory:.2f}" if result.memory is not None else "-"
+        print(
+            f"{result.name:<{width}}  {result.throughput:>12.1f}  {percentile(result.samples, 0.5) * 1000:>10.2f}  "
+            f"{percentile(result.samples, 0.99) * 1000:>10.2f}  {memory:>9}  {result.errors:>6}"
+        )
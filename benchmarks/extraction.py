@@ -0,0 +1,49 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import typing
+from itertools import cycle
+from collections.abc import Callable
+
+import typer
+from selectolax.lexbor import LexborHTMLParser
+
+from benchmarks.common import Result, fill, load_fixtures, measure, report
+from usps.tracking import StatusNotAvailable
+from usps.tracking.usps import USPSTracking, extract_page
+
+# Scenarios
+def pages(name: str, html: list[str], rounds: int, function: Callable[[str], object]) -> Result:
+    documents = cycle(html)
+
+    # Each sample is one page, pages that say there's no tracking information count as errors
+    def run() -> int:
+        try:
+            function(next(documents))
+            return 0
+
+        except StatusNotAvailable:
+            return 1
+
+    return measure(name, 1, rounds, run)
+
+# Main
+def main(
+    rounds: typing.Annotated[int, typer.Option(help = "Times to go through every fixture page.")] = 500,
+    fixture: typing.Annotated[typing.Optional[list[str]], typer.Option(help = "Only use these USPS fixtures (in_transit, delivered, not_found).")] = None,
+    json: typing.Annotated[bool, typer.Option("--json", help = "Print the results as JSON.")] = False,
+) -> None:
+    """Benchmark pulling tracking details out of the recorded USPS pages."""
+    html = [fill(page, "9400100000000000000000") for name, page in load_fixtures("usps").items() if not fixture or name in fixture]
+    if not html:
+        raise typer.BadParameter("no fixture pages matched", param_hint = "--fixture")
+
+    rounds *= len(html)
+    report([
+        pages("usps.html_parse", html, rounds, LexborHTMLParser),   # The floor, just building the tree
+        pages("usps.extract_page", html, rounds, extract_page),
+        pages("usps.parse_page", html, rounds, USPSTracking.parse_page)
+    ], json, "pages")
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,124 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import gc
+import json
+import time
+import typing
+import tracemalloc
+from datetime import datetime
+from dataclasses import dataclass
+from collections.abc import Callable
+
+import typer
+
+from benchmarks.common import fill, load_fixtures, usps_numbers
+from usps.tracking import Package
+from usps.tracking.store import StepStore
+from usps.tracking.usps import USPSTracking
+from usps.tracking.ups import UPSTracking
+
+# What Package and Step looked like before they were slotted and interned, kept around to compare against
+@dataclass
+class PlainStep:
+    details:    str
+    location:   str
+    time:       datetime | None
+
+@dataclass
+class PlainPackage:
+    expected:       list[datetime] | None
+    last_status:    str | None
+    state:          str
+    steps:          list[PlainStep]
+    service:        str | None
+
+# Handle building histories
+def recorded_packages() -> list[Package]:
+    packages = [USPSTracking.parse_page(fill(html, "9400100000000000000000")) for name, html in load_fixtures("usps").items() if name != "not_found"]
+    for detail in load_fixtures("ups").values():
+        packages.append(UPSTracking.parse_details(json.loads(fill(detail, "1Z999AA10123456784"))))
+
+    return packages
+
+# Every package gets rebuilt from scratch, so nothing is shared unless the representation shares it
+def as_dicts(templates: list[dict], count: int) -> list[dict]:
+    return [json.loads(json.dumps(templates[index % len(templates)])) for index in range(count)]
+
+def as_plain(templates: list[dict], count: int) -> list[PlainPackage]:
+    packages = []
+    for data in as_dicts(templates, count):
+        steps = [PlainStep(step["details"], step["location"], step["time"] and datetime.fromisoformat(step["time"])) for step in data["steps"]]
+        expected = [datetime.fromisoformat(time) for time in data["expected"]] if data["expected"] is not None else None
+        packages.append(PlainPackage(expected, data["last_status"], data["state"], steps, data["service"]))
+
+    return packages
+
+def as_packages(templates: list[dict], count: int) -> list[Package]:
+    return [Package.from_dict(data) for data in as_dicts(templates, count)]
+
+def as_store(templates: list[dict], keys: list[str]) -> tuple[list[Package], StepStore]:
+    packages, store = as_packages(templates, len(keys)), StepStore()
+    for tracking_number, package in zip(keys, packages):
+        store.put(tracking_number, package.steps)
+        package.steps = []
+
+    return packages, store
+
+# Measurements
+def footprint(name: str, steps: int, build: Callable[[], object]) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        history = build()
+        elapsed = time.perf_counter() - start
+
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+
+    finally:
+        tracemalloc.stop()
+
+    del history
+    return {"name": name, "bytes": size, "bytes_per_step": size / steps, "build": elapsed}
+
+def conversion(store: StepStore, keys: list[str]) -> float:
+    start = time.perf_counter()
+    for key in keys:
+        store.get(key)
+
+    return time.perf_counter() - start
+
+# Main
+def main(
+    packages: typing.Annotated[int, typer.Option(help = "Packages of history to keep in memory.")] = 20000,
+    json_output: typing.Annotated[bool, typer.Option("--json", help = "Print the results as JSON.")] = False,
+) -> None:
+    """Benchmark how much memory large package histories take in each representation."""
+    templates, keys = [package.to_dict() for package in recorded_packages()], usps_numbers(packages)
+    steps = sum(len(templates[index % len(templates)]["steps"]) for index in range(packages))
+
+    results = [
+        footprint("dicts", steps, lambda: as_dicts(templates, packages)),
+        footprint("plain_dataclasses", steps, lambda: as_plain(templates, packages)),
+        footprint("slotted_dataclasses", steps, lambda: as_packages(templates, packages)),
+        footprint("step_store", steps, lambda: as_store(templates, keys))
+    ]
+
+    # Watch mode turns stored steps back into Step objects whenever a package changes
+    _, store = as_store(templates, keys)
+    elapsed = conversion(store, keys)
+
+    if json_output:
+        return print(json.dumps({"packages": packages, "steps": steps, "results": results, "step_store_get": elapsed}, indent = 4))
+
+    print(f"{packages} packages, {steps} steps\n")
+    print(f"{'representation':<20}  {'MiB':>8}  {'bytes/step':>10}  {'build ms':>9}")
+    for result in results:
+        print(f"{result['name']:<20}  {result['bytes'] / 1024 ** 2:>8.2f}  {result['bytes_per_step']:>10.1f}  {result['build'] * 1000:>9.1f}")
+
+    print(f"\nStepStore.get for every package: {elapsed * 1000:.1f}ms ({elapsed / steps * 1e9:.0f}ns per step), columns take {store.nbytes / 1024 ** 2:.2f} MiB")
+
+if __name__ == "__main__":
+    typer.run(main)
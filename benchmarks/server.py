@@ -0,0 +1,162 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import json
+import time
+import random
+from threading import Lock, Thread
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.common import PLACEHOLDER, fill, load_fixtures
+from usps.tracking.usps import USPSTracking
+from usps.tracking.transport import BASE_URLS, configure_base_url
+
+# Handle requests
+class CarrierHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes, which would otherwise wait on a delayed ACK
+    server: "CarrierHTTPServer"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.fake.count("connections")
+
+    def reply(self, status: int, body: str, content_type: str, headers: dict[str, str] | None = None) -> None:
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(content)
+
+    def handle_request(self, route: str) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))   # Even failed requests need their body read for keep-alive
+        fake = self.server.fake
+        fake.count(route)
+        fake.delay()
+        if fake.should_fail():
+            fake.count("errors")
+            return self.reply(503, "<html><body><h1>Service Unavailable</h1></body></html>", "text/html")
+
+        match route:
+            case "usps":
+                tracking_number = parse_qs(urlsplit(self.path).query).get("qtc_tLabels1", [""])[0]
+                self.reply(200, fake.usps_page(tracking_number), "text/html; charset=utf-8")
+
+            case "ups.token":
+                self.reply(200, "<html><body>UPS Tracking</body></html>", "text/html", {"Set-Cookie": "X-XSRF-TOKEN-ST=benchmark; Path=/"})
+
+            case "ups.status":
+                self.reply(200, fake.ups_status(json.loads(body or b"{}").get("TrackingNumber", [])), "application/json")
+
+    def do_GET(self) -> None:
+        path = urlsplit(self.path).path
+        if path == "/go/TrackConfirmAction":
+            return self.handle_request("usps")
+
+        if path == "/track":
+            return self.handle_request("ups.token")
+
+        self.reply(404, "Not Found", "text/plain")
+
+    def do_POST(self) -> None:
+        if urlsplit(self.path).path == "/track/api/Track/GetStatus":
+            return self.handle_request("ups.status")
+
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply(404, "Not Found", "text/plain")
+
+class CarrierHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128    # The default backlog of 5 stalls bursts of new connections for a whole second
+    fake: "FakeCarrierServer"
+
+# Main class
+# Stands in for both USPS and UPS, serving recorded pages with injected latency and errors
+class FakeCarrierServer:
+    def __init__(self, latency: float = 0.02, jitter: float = 0, error_rate: float = 0, seed: int = 0) -> None:
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.random = random.Random(seed)
+        self.counts: Counter[str] = Counter()
+        self.lock = Lock()
+
+        self.usps_fixtures = [page for name, page in load_fixtures("usps").items() if name != "not_found"]
+        self.ups_fixtures = [json.loads(detail) for detail in load_fixtures("ups").values()]
+
+        self.server: CarrierHTTPServer | None = None
+        self.previous_urls: dict[str, str] = {}
+
+    # Fault injection
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] += 1
+
+    def delay(self) -> None:
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    # Responses, the fixture used only depends on the tracking number so repeated runs line up
+    def usps_page(self, tracking_number: str) -> str:
+        return fill(self.usps_fixtures[sum(tracking_number.encode()) % len(self.usps_fixtures)], tracking_number)
+
+    def ups_status(self, tracking_numbers: list[str]) -> str:
+        details = []
+        for tracking_number in tracking_numbers:
+            detail = json.dumps(self.ups_fixtures[sum(tracking_number.encode()) % len(self.ups_fixtures)])
+            details.append(json.loads(detail.replace(PLACEHOLDER, tracking_number)))
+
+        return json.dumps({"statusCode": "200", "statusText": "Successful", "isLoggedInUser": False, "trackDetails": details})
+
+    # Lifetime
+    @property
+    def url(self) -> str:
+        if self.server is None:
+            raise RuntimeError("The fake carrier server isn't running")
+
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> "FakeCarrierServer":
+        self.server = CarrierHTTPServer(("127.0.0.1", 0), CarrierHandler)
+        self.server.fake = self
+        Thread(target = self.server.serve_forever, daemon = True).start()
+
+        # Point every carrier at us instead
+        for name in ("USPS", "UPS", "UPS_API"):
+            self.previous_urls[name] = BASE_URLS[name]
+            configure_base_url(name, self.url)
+
+        # We don't check cookies, this just keeps USPS from starting Firefox to go get real ones
+        USPSTracking._cookies, USPSTracking._expires = {"benchmark": "1"}, None
+        return self
+
+    def stop(self) -> None:
+        if self.server is None:
+            return
+
+        for name, url in self.previous_urls.items():
+            configure_base_url(name, url)
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+    def __enter__(self) -> "FakeCarrierServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -0,0 +1,79 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import sys
+import typing
+import subprocess
+
+import typer
+
+from benchmarks.common import Result, measure, report
+
+# Modules that only the commands actually tracking or printing for humans should pay for
+LAZY_MODULES = ["selenium", "rich", "selectolax", "requests", "httpx", "asyncio", "ssl", "usps.tracking.usps", "usps.tracking.ups"]
+
+COMMANDS = {
+    "import":   "import usps.__main__",
+    "version":  "import sys; from usps.__main__ import app; sys.argv = ['usps', 'version']; app()",
+    "list":     "import sys; from usps.__main__ import app; sys.argv = ['usps', 'list', '--format', 'jsonl']; app()",
+}
+
+# Checks
+def loaded_modules() -> list[str]:
+    check = f"import sys, usps.__main__; print(*[name for name in {LAZY_MODULES!r} if name in sys.modules])"
+    return subprocess.run([sys.executable, "-c", check], capture_output = True, text = True, check = True).stdout.split()
+
+def import_times() -> list[tuple[int, str]]:
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", COMMANDS["import"]], capture_output = True, text = True, check = True).stderr
+
+    # Lines look like "import time:   self [us] | cumulative | package"
+    times = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times.append((int(cumulative), name.strip()))
+
+    return sorted(times, reverse = True)
+
+# Scenarios
+def startup(name: str, code: str, rounds: int) -> Result:
+    def run() -> int:
+        return subprocess.run([sys.executable, "-c", code], capture_output = True).returncode != 0
+
+    return measure(f"startup.{name}", 1, rounds, run, memory = False)
+
+# Main
+def main(
+    rounds: typing.Annotated[int, typer.Option(help = "Times to start each command.")] = 20,
+    top: typing.Annotated[int, typer.Option(help = "Show this many of the slowest imports.")] = 10,
+    max_ms: typing.Annotated[typing.Optional[float], typer.Option(help = "Fail if starting any command takes longer than this (p50).")] = None,
+    json: typing.Annotated[bool, typer.Option("--json", help = "Print the results as JSON.")] = False,
+) -> None:
+    """Benchmark how long the CLI takes to start, failing if it loads modules it shouldn't need."""
+    results = [startup(name, code, rounds) for name, code in COMMANDS.items()]
+    report(results, json, "starts")
+
+    if not json:
+        print("\nSlowest imports behind usps.__main__ (cumulative):")
+        for cumulative, name in import_times()[:top]:
+            print(f"{cumulative / 1000:>10.2f} ms  {name}")
+
+    failed = False
+    loaded = loaded_modules()
+    if loaded:
+        print(f"\nImporting usps.__main__ loaded modules it should leave for later: {', '.join(loaded)}", file = sys.stderr)
+        failed = True
+
+    for result in results:
+        if result.errors:
+            print(f"{result.name} exited with an error {result.errors} time(s)", file = sys.stderr)
+            failed = True
+
+        if max_ms is not None and result.to_dict()["p50"] * 1000 > max_ms:
+            print(f"{result.name} took longer than {max_ms}ms to start", file = sys.stderr)
+            failed = True
+
+    if failed:
+        raise typer.Exit(1)
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,86 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import typing
+import asyncio
+from itertools import count
+
+import typer
+
+from benchmarks.common import NUMBERS, Result, measure, report
+from benchmarks.server import FakeCarrierServer
+from usps.tracking import StatusNotAvailable, track_package, track_packages, track_packages_async
+from usps.tracking.ratelimit import configure_rate_limit
+from usps.tracking.transport import close_async_clients
+
+# Scenarios
+def single(service: str, rounds: int) -> Result:
+    numbers, position = NUMBERS[service](rounds * 2), count()
+
+    # One package per call, going through the cache like `usps track <number>` does
+    def run() -> int:
+        try:
+            track_package(numbers[next(position) % len(numbers)], use_cache = False)
+            return 0
+
+        except StatusNotAvailable:
+            return 1
+
+    return measure(f"{service.lower()}.single", 1, rounds, run)
+
+def bulk(service: str, packages: int, concurrency: int, rounds: int) -> Result:
+    numbers = NUMBERS[service](packages)
+
+    def run() -> int:
+        results = track_packages(numbers, {service: concurrency}, use_cache = False)
+        return sum(isinstance(result, StatusNotAvailable) for result in results.values())
+
+    return measure(f"{service.lower()}.bulk", packages, rounds, run)
+
+def concurrent(service: str, packages: int, concurrency: int, rounds: int) -> Result:
+    numbers = NUMBERS[service](packages)
+
+    async def track() -> int:
+        try:
+            results = await track_packages_async(numbers, {service: concurrency}, use_cache = False)
+            return sum(isinstance(result, StatusNotAvailable) for result in results.values())
+
+        finally:
+            await close_async_clients()
+
+    return measure(f"{service.lower()}.concurrent", packages, rounds, lambda: asyncio.run(track()))
+
+# Main
+def main(
+    packages: typing.Annotated[int, typer.Option(help = "Packages tracked per bulk or concurrent round.")] = 200,
+    rounds: typing.Annotated[int, typer.Option(help = "Rounds for the bulk and concurrent benchmarks, single runs 25x this many calls.")] = 3,
+    concurrency: typing.Annotated[int, typer.Option(help = "Packages tracked at once per carrier.")] = 8,
+    latency: typing.Annotated[float, typer.Option(help = "Milliseconds the fake carrier takes to answer each request.")] = 20,
+    jitter: typing.Annotated[float, typer.Option(help = "Up to this many extra milliseconds of random latency per request.")] = 10,
+    error_rate: typing.Annotated[float, typer.Option(help = "Fraction of requests answered with a 503.")] = 0,
+    rate_limit: typing.Annotated[typing.Optional[float], typer.Option(help = "Requests per second allowed to the fake carrier, unlimited by default.")] = None,
+    carrier: typing.Annotated[typing.Optional[list[str]], typer.Option(help = "Only benchmark these carriers.")] = None,
+    json: typing.Annotated[bool, typer.Option("--json", help = "Print the results as JSON.")] = False,
+) -> None:
+    """Benchmark single, bulk and concurrent tracking against a local fake carrier server."""
+    if rate_limit is not None and rate_limit <= 0:
+        raise typer.BadParameter("needs to be more than 0 requests per second", param_hint = "--rate-limit")
+
+    if rate_limit is not None:
+        configure_rate_limit("127.0.0.1", rate_limit)
+
+    results = []
+    with FakeCarrierServer(latency / 1000, jitter / 1000, error_rate) as server:
+        for service in [name.upper() for name in carrier] if carrier else ["USPS", "UPS"]:
+            results += [
+                single(service, rounds * 25),
+                bulk(service, packages, concurrency, rounds),
+                concurrent(service, packages, concurrency, rounds)
+            ]
+
+    report(results, json, "packages")
+    if not json:
+        print(f"\n{server.counts['connections']} connections, {server.counts['errors']} injected errors")
+
+if __name__ == "__main__":
+    typer.run(main)
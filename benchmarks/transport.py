@@ -0,0 +1,118 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import time
+import typing
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import typer
+
+from benchmarks.common import Result, report, usps_numbers
+from benchmarks.server import FakeCarrierServer
+from usps.tracking.transport import close_async_clients, configure_transport, get_async_client, get_session
+
+# Helpers
+def timed(fetch: Callable[[str], int], url: str) -> tuple[float, bool]:
+    start = time.perf_counter()
+    try:
+        ok = fetch(url) == 200
+
+    except Exception:  # Whatever the client raises, it's just a failed request here
+        ok = False
+
+    return time.perf_counter() - start, ok
+
+def threaded(name: str, urls: list[str], concurrency: int, fetch: Callable[[str], int]) -> Result:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(lambda url: timed(fetch, url), urls))
+
+    return Result(name, len(urls), time.perf_counter() - start, [sample for sample, _ in samples], None, sum(not ok for _, ok in samples))
+
+# Scenarios
+def fresh(urls: list[str], concurrency: int) -> Result:
+    import requests
+
+    # No pooling at all, every request pays for its own connection
+    def fetch(url: str) -> int:
+        with requests.Session() as session:
+            return session.get(url, timeout = 10).status_code
+
+    return threaded("requests.fresh", urls, concurrency, fetch)
+
+def pooled(urls: list[str], concurrency: int, pool_size: int) -> Result:
+    configure_transport("USPS", pool_size = pool_size)
+    session = get_session("USPS")
+    return threaded(f"requests.pool_{pool_size}", urls, concurrency, lambda url: session.get(url, timeout = 10).status_code)
+
+def asynchronous(urls: list[str], concurrency: int) -> Result | None:
+    configure_transport("USPS", pool_size = concurrency)
+
+    async def run() -> tuple[float, list[tuple[float, bool]]]:
+        client = get_async_client("USPS")
+        if client is None:
+            return 0, []
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(url: str) -> tuple[float, bool]:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    ok = (await client.get(url, timeout = 10)).status_code == 200
+
+                except Exception:  # Whatever the client raises, it's just a failed request here
+                    ok = False
+
+                return time.perf_counter() - start, ok
+
+        try:
+            start = time.perf_counter()
+            samples = await asyncio.gather(*[fetch(url) for url in urls])
+            return time.perf_counter() - start, samples
+
+        finally:
+            await close_async_clients()
+
+    elapsed, samples = asyncio.run(run())
+    if not samples:
+        return None
+
+    return Result("httpx.async", len(urls), elapsed, [sample for sample, _ in samples], None, sum(not ok for _, ok in samples))
+
+# Main
+def main(
+    requests: typing.Annotated[int, typer.Option(help = "Requests sent per benchmark.")] = 500,
+    concurrency: typing.Annotated[int, typer.Option(help = "Requests in flight at once.")] = 16,
+    pool_size: typing.Annotated[typing.Optional[list[int]], typer.Option(help = "Connection pool sizes to compare, defaults to 1 and --concurrency.")] = None,
+    latency: typing.Annotated[float, typer.Option(help = "Milliseconds the fake carrier takes to answer each request.")] = 5,
+    json: typing.Annotated[bool, typer.Option("--json", help = "Print the results as JSON.")] = False,
+) -> None:
+    """Benchmark requests per second through the carrier transport against a local fake carrier server."""
+    results, connections = [], {}
+    with FakeCarrierServer(latency / 1000) as server:
+        urls = [f"{server.url}/go/TrackConfirmAction?qtc_tLabels1={number}" for number in usps_numbers(requests)]
+
+        def run(benchmark: Callable[[], Result | None]) -> None:
+            opened = server.counts["connections"]
+            result = benchmark()
+            if result is not None:
+                results.append(result)
+                connections[result.name] = server.counts["connections"] - opened
+
+        run(lambda: fresh(urls, concurrency))
+        for size in pool_size or [1, concurrency]:
+            run(lambda: pooled(urls, concurrency, size))
+
+        run(lambda: asynchronous(urls, concurrency))
+
+    report(results, json, "requests")
+    if not json:
+        print("\nConnections opened:", ", ".join(f"{name} {count}" for name, count in connections.items()))
+        if "httpx.async" not in connections:
+            print("httpx isn't installed, so the async client was skipped")
+
+if __name__ == "__main__":
+    typer.run(main)
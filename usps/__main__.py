@@ -1,36 +1,62 @@
 # Copyright (c) 2024 iiPython
 
 # Modules
+import csv
+import sys
 import time
 import typing
 import textwrap
+import functools
+from pathlib import Path
+from contextlib import nullcontext
+from datetime import datetime
 
 import typer
-from rich.console import Console
 
 from usps.storage import packages
 
 from usps import __version__
-from usps.timezones import get_delta
-from usps.tracking import track_package, get_service, StatusNotAvailable
+from usps.timezones import LOCAL_TIMEZONE, get_delta, get_deltas
+from usps.tracking import Package, iter_packages, get_carrier, get_service, classify, classify_many, configure_progress, PROGRESS, StatusNotAvailable
+from usps.tracking.numbers import normalize
+from usps.tracking.steps import UNKNOWN_STEPS
+from usps.tracking.ratelimit import CARRIER_HOSTS, configure_carrier_rate_limit
+from usps.changes import Change, iter_changes
+from usps.output import CHANGE_FIELDS, LIST_FIELDS, PACKAGE_FIELDS, OutputFormat, RecordWriter, guess_format, package_record, read_records
+from usps.watch import Watcher
+from usps.metrics import MetricsFormat, metrics
+
+if typing.TYPE_CHECKING:
+    from rich.console import Console
 
 # Initialization
 app = typer.Typer(help = "A CLI for tracking packages from USPS.", pretty_exceptions_show_locals = False)
-con = Console(highlight = False)
+
+cookies_app = typer.Typer(help = "Manage the cookies used for tracking USPS packages.")
+app.add_typer(cookies_app, name = "cookies")
+
+# Rich is only loaded once something actually gets printed for humans
+@functools.cache
+def console() -> "Console":
+    from rich.console import Console
+    return Console(highlight = False)
 
 # Handle commands
-def show_package(tracking_number: str, name: str | None) -> None:
+def format_identifier(tracking_number: str, name: str | None) -> str:
     identifier = f"{get_service(tracking_number)} [bright_blue]{tracking_number}[/]"
     if name is not None:
         identifier = f"{name} ({identifier})"
 
-    try:
-        package = track_package(tracking_number)
-        con.print(f"°︎ {identifier}{f', [bright_blue]{package.service}[/]' if package.service is not None else ''} - [cyan]{package.state}[/]")
+    return identifier
+
+def show_package(tracking_number: str, name: str | None, package: Package | StatusNotAvailable, now: datetime | None = None) -> None:
+    identifier = format_identifier(tracking_number, name)
+
+    if isinstance(package, StatusNotAvailable):
+        return console().print(f"°︎ {identifier} - [red]{package}[/]")
+
+    console().print(f"°︎ {identifier}{f', [bright_blue]{package.service}[/]' if package.service is not None else ''} - [cyan]{package.state}[/]")
 
-    except StatusNotAvailable as failure:
-        return con.print(f"°︎ {identifier} - [red]{failure}[/]")
-    
     if package.expected:
         def ordinal(day: int) -> str:
             return str(day) + ("th" if 4 <= day % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th"))
@@ -40,79 +66,362 @@ def show_package(tracking_number: str, name: str | None) -> None:
         # Show delivery time based on whether there's 1 or 2
         times = [time.strftime("%I:%M %p") for time in package.expected]
         if len(package.expected) == 1:
-            con.print(f"\t[green]Estimated delivery on {date} by {times[0]}.[/]")
+            console().print(f"\t[green]Estimated delivery on {date} by {times[0]}.[/]")
 
         else:
-            con.print(f"\t[green]Estimated delivery on {date} between {times[0]} and {times[1]}.[/]")
+            console().print(f"\t[green]Estimated delivery on {date} between {times[0]} and {times[1]}.[/]")
 
     else:
         if package.state == "Delivered":
-            con.print("\t[green]This package has been delivered.[/]")
+            console().print("\t[green]This package has been delivered.[/]")
 
         else:
-            con.print("\t[red]No estimated delivery time yet.[/]")
+            console().print("\t[red]No estimated delivery time yet.[/]")
 
-    con.print(
+    console().print(
         *[f"\t[yellow]{line}[/]" for line in textwrap.wrap(package.last_status, 102)] if package.last_status is not None else [],
         "",
         sep = "\n"
     )
 
     # Print out steps
-    location_max = len(max(package.steps, key = lambda _package: len(_package.location)).location)
-    for step in package.steps[:10]:
+    steps = package.steps[:10]
+    location_max = max((len(step.location) for step in steps), default = 0)
+    for step, delta in zip(steps, get_deltas([(step.location, step.time) for step in steps], now)):
         location_block = f"[yellow]{step.location}[/]{' ' * (location_max - len(step.location))}"
-        con.print(f"\t[cyan]{step.details}[/]\t{location_block}\t[bright_blue]{get_delta(step.location, step.time) if step.time else ''}[/]")
+        console().print(f"\t[cyan]{step.details}[/]\t{location_block}\t[bright_blue]{delta}[/]")
 
     print()
 
+def show_change(name: str | None, change: Change, now: datetime | None = None) -> None:
+    identifier = format_identifier(change.tracking_number, name)
+    if change.step is None:
+        previous = f"[cyan]{change.previous_state}[/] → " if change.previous_state is not None else ""
+        return console().print(f"°︎ {identifier} - {previous}[cyan]{change.state}[/]")
+
+    step = change.step
+    console().print(f"°︎ {identifier} - [cyan]{step.details}[/]\t[yellow]{step.location}[/]\t[bright_blue]{get_delta(step.location, step.time, now) if step.time else ''}[/]")
+
+def apply_rate_limit(rate_limit: float | None) -> None:
+    if rate_limit is not None and rate_limit <= 0:
+        raise typer.BadParameter("needs to be more than 0 requests per second", param_hint = "--rate-limit")
+
+    if rate_limit is not None:
+        for service in CARRIER_HOSTS:
+            configure_carrier_rate_limit(service, rate_limit)
+
+def show_stats(output: OutputFormat | None) -> None:
+    if output is not None:
+        return print(metrics.to_json(), file = sys.stderr)
+
+    snapshot = metrics.snapshot()
+    console().print("[cyan]Stats:[/]")
+    for name, value in sorted(snapshot["counters"].items()):
+        console().print(f"\t[yellow]{name}[/]\t{value}")
+
+    for name, timer in sorted(snapshot["timers"].items()):
+        console().print(
+            f"\t[yellow]{name}[/]\t{timer['count']}x, {timer['total'] * 1000:.1f}ms total, "
+            f"{timer['average'] * 1000:.1f}ms average, {timer['max'] * 1000:.1f}ms max"
+        )
+
+def report_unknown_steps(output: OutputFormat | None) -> None:
+    for (carrier, details), count in UNKNOWN_STEPS.items():
+        message = f"Missing {carrier} step mapping! Post this on GitHub: \"{details}\" (seen {count} time{'s' if count > 1 else ''})"
+        if output is not None:
+            print(message, file = sys.stderr)
+
+        else:
+            console().print(f"[yellow]{message}[/]")
+
+    UNKNOWN_STEPS.clear()
+
+def show_live(
+    tracking_numbers: dict[str, str | None],
+    concurrency: int | None,
+    use_cache: bool,
+    max_age: float | None,
+    refresh: int,
+    stats: bool
+) -> None:
+    from rich.live import Live
+    from usps.live import PackageTable
+
+    # Old results stay on screen while new ones come in, each row only changing once its package does
+    limits = {"UPS": concurrency, "USPS": concurrency} if concurrency is not None else None
+    table = PackageTable(tracking_numbers)
+
+    # The cookie spinner would fight Live over the terminal, so it stays off until we're done
+    progress = PROGRESS["enabled"]
+    configure_progress(False)
+    try:
+        with Live(table, console = console(), auto_refresh = False) as live:
+            while True:
+                now = datetime.now(LOCAL_TIMEZONE)
+                table.tick(now)
+                live.refresh()
+
+                for tracking_number, package in iter_packages(tracking_numbers, limits, use_cache, max_age):
+                    with metrics.timer("render"):
+                        if table.update(tracking_number, package, now):
+                            live.refresh()
+
+                report_unknown_steps(None)
+                if stats:
+                    show_stats(None)
+
+                time.sleep(refresh * 60)
+
+    finally:
+        configure_progress(progress)
+
+def show_packages(
+    tracking_numbers: dict[str, str | None],
+    concurrency: int | None,
+    use_cache: bool,
+    max_age: float | None,
+    changes_only: bool = False,
+    output: OutputFormat | None = None
+) -> None:
+    limits = {"UPS": concurrency, "USPS": concurrency} if concurrency is not None else None
+    if output is not None:
+        writer = RecordWriter(output, CHANGE_FIELDS if changes_only else PACKAGE_FIELDS)
+        if changes_only:
+            for change in iter_changes(tracking_numbers, limits, use_cache, max_age):
+                writer.write(change.to_dict() | {"name": tracking_numbers[change.tracking_number]})
+
+        else:
+            for tracking_number, package in iter_packages(tracking_numbers, limits, use_cache, max_age):
+                writer.write(package_record(tracking_number, tracking_numbers[tracking_number], package))
+
+        writer.close()
+
+    elif changes_only:
+        now = datetime.now(LOCAL_TIMEZONE)
+        for change in iter_changes(tracking_numbers, limits, use_cache, max_age):
+            show_change(tracking_numbers[change.tracking_number], change, now)
+
+    else:
+        now = datetime.now(LOCAL_TIMEZONE)
+        for tracking_number, package in iter_packages(tracking_numbers, limits, use_cache, max_age):
+            with metrics.timer("render"):
+                show_package(tracking_number, tracking_numbers[tracking_number], package, now)
+
+    report_unknown_steps(output)
+
 @app.command("track")
 def command_track(
     tracking_number: typing.Annotated[typing.Optional[str], typer.Argument()] = None,
     refresh: typing.Annotated[typing.Optional[int], typer.Option(help = "Auto refresh the tracking information every x minutes.")] = None,
+    concurrency: typing.Annotated[typing.Optional[int], typer.Option(help = "Maximum number of packages to track at once per carrier.")] = None,
+    cache: typing.Annotated[bool, typer.Option(help = "Reuse recently fetched tracking information.")] = True,
+    max_age: typing.Annotated[typing.Optional[float], typer.Option(help = "Only reuse cached tracking information newer than x minutes.")] = None,
+    changes_only: typing.Annotated[bool, typer.Option(help = "Only show new steps and state changes since the last time a package was tracked.")] = False,
+    format: typing.Annotated[typing.Optional[OutputFormat], typer.Option(help = "Output machine readable records instead of formatted text.")] = None,
+    rate_limit: typing.Annotated[typing.Optional[float], typer.Option(help = "Maximum requests per second to send to each carrier host.")] = None,
+    stats: typing.Annotated[bool, typer.Option(help = "Show where time was spent after tracking.")] = False,
 ) -> None:
     """Track the specified tracking numbers, tracking your package list if no tracking
     number is specified."""
+    if format == OutputFormat.json and refresh is not None:
+        raise typer.BadParameter("a JSON array can't keep growing between refreshes, use --format jsonl instead", param_hint = "--format")
+
+    max_age = max_age * 60 if max_age is not None else None
+    apply_rate_limit(rate_limit)
+    configure_progress(format is None)
+    metrics.enabled = stats
 
     if tracking_number is not None:
-        return show_package(tracking_number, None)
+        tracking_number = normalize(tracking_number)
+        show_packages({tracking_number: None}, concurrency, cache, max_age, changes_only, format)
+        return show_stats(format) if stats else None
 
     tracking_numbers = packages.load()
     if not tracking_numbers:
-        return con.print("[red]× You don't have any default packages to track.[/]")
+        if format is not None:
+            return RecordWriter(format, PACKAGE_FIELDS).close()
+
+        return console().print("[red]× You don't have any default packages to track.[/]")
 
     if refresh is not None:
+        if any(get_service(tracking_number) == "USPS" for tracking_number in tracking_numbers):
+            get_carrier("USPS").refresh_in_background()
+
+        if not changes_only and format is None:
+            return show_live(tracking_numbers, concurrency, cache, max_age, refresh, stats)
+
         while True:
-            print("\033[H\033[2J", end = "")
-            for package, name in tracking_numbers.items():
-                show_package(package, name)
+            show_packages(tracking_numbers, concurrency, cache, max_age, changes_only, format)
+            if stats:
+                show_stats(format)
 
             time.sleep(refresh * 60)
 
     else:
-        for package, name in tracking_numbers.items():
-            show_package(package, name)
+        show_packages(tracking_numbers, concurrency, cache, max_age, changes_only, format)
+        if stats:
+            show_stats(format)
+
+@app.command("watch")
+def command_watch(
+    concurrency: typing.Annotated[typing.Optional[int], typer.Option(help = "Maximum number of packages to track at once per carrier.")] = None,
+    rate_limit: typing.Annotated[typing.Optional[float], typer.Option(help = "Maximum requests per second to send to each carrier host.")] = None,
+    metrics_file: typing.Annotated[typing.Optional[Path], typer.Option(help = "Keep this file updated with metrics after every poll.")] = None,
+    metrics_format: typing.Annotated[MetricsFormat, typer.Option(help = "Format to write the metrics file in.")] = MetricsFormat.json,
+) -> None:
+    """Keep watching your package list, polling each package based on its state and
+    only showing packages that changed."""
+    apply_rate_limit(rate_limit)
+    metrics.enabled = metrics_file is not None
+    watcher = Watcher({"UPS": concurrency, "USPS": concurrency} if concurrency is not None else None)
+    if any(get_service(tracking_number) == "USPS" for tracking_number in packages.load()):
+        get_carrier("USPS").refresh_in_background()
+
+    while True:
+        tracking_numbers = packages.load()
+        watcher.sync(list(tracking_numbers))
+
+        changed = watcher.poll()
+        if changed:
+            now = datetime.now(LOCAL_TIMEZONE)
+            console().print(f"[bright_black]── {now.strftime('%D %I:%M %p')} ──[/]")
+            for tracking_number, package in changed:
+                show_package(tracking_number, tracking_numbers.get(tracking_number), package, now)
+
+        report_unknown_steps(None)
+        if metrics_file is not None:
+            metrics_file.write_text(metrics.to_json() if metrics_format == MetricsFormat.json else metrics.to_prometheus())
+
+        # Wake up at least once a minute to notice packages being added or removed
+        next_poll = watcher.next_poll()
+        time.sleep(max(min(next_poll - time.time(), 60), 1) if next_poll is not None else 60)
+
+@app.command("serve")
+def command_serve(
+    host: typing.Annotated[str, typer.Option(help = "Address to listen on.")] = "127.0.0.1",
+    port: typing.Annotated[int, typer.Option(help = "Port to listen on.")] = 8080,
+    concurrency: typing.Annotated[typing.Optional[int], typer.Option(help = "Maximum number of packages to track at once per carrier.")] = None,
+    rate_limit: typing.Annotated[typing.Optional[float], typer.Option(help = "Maximum requests per second to send to each carrier host.")] = None,
+) -> None:
+    """Run a local HTTP API for tracking packages, keeping sessions, cookies and results
+    warm between requests."""
+    import asyncio
+    from usps.server import serve
+
+    apply_rate_limit(rate_limit)
+    get_carrier("USPS").refresh_in_background()
+
+    console().print(f"[cyan]Listening on [yellow]http://{host}:{port}[/], press Ctrl+C to stop.[/]")
+    try:
+        asyncio.run(serve(host, port, {"UPS": concurrency, "USPS": concurrency} if concurrency is not None else None))
+
+    except KeyboardInterrupt:
+        pass
+
+@cookies_app.command("refresh")
+def command_cookies_refresh(
+    force: typing.Annotated[bool, typer.Option(help = "Regenerate the cookies even if they haven't expired yet.")] = False,
+) -> None:
+    """Regenerate the USPS security cookies if they are about to expire."""
+    if not get_carrier("USPS").refresh_security(force):
+        return console().print("[green]✓ Cookies are still valid, nothing to refresh.[/]")
+
+    console().print("[green]✓ Cookies have been regenerated.[/]")
+
+@cookies_app.command("status")
+def command_cookies_status() -> None:
+    """Show when the current USPS security cookies expire."""
+    tracking = get_carrier("USPS")
+    has_cookies, expires = tracking.security_status()
+    if not has_cookies:
+        return console().print("[red]× No cookies have been generated yet.[/]")
+
+    if expires is None:
+        return console().print("[yellow]Cookies are saved, but their expiry time is unknown.[/]")
+
+    expiry = datetime.fromtimestamp(expires).strftime("%D %I:%M %p")
+    if tracking.cookies_expired():
+        return console().print(f"[red]× Cookies expired on {expiry}.[/]")
+
+    console().print(f"[green]✓ Cookies expire on {expiry}.[/]")
 
 @app.command("add")
 def command_add(tracking_numbers: list[str]) -> None:
     """Add tracking numbers to your package list."""
-    packages.save(packages.load() | {number: None for number in tracking_numbers})
-    for tracking_number in tracking_numbers:
-        con.print(f"[green]✓ USPS {tracking_number} added to your package list.[/]")
+    services = classify_many(normalize(tracking_number) for tracking_number in tracking_numbers)
+    for tracking_number, service in services.items():
+        if service is None:
+            console().print(f"[red]× {tracking_number} is not a valid tracking number.[/]")
+
+    added = set(packages.add([tracking_number for tracking_number, service in services.items() if service is not None]))
+    for tracking_number, service in services.items():
+        if tracking_number in added:
+            console().print(f"[green]✓ {service} {tracking_number} added to your package list.[/]")
+
+        elif service is not None:
+            console().print(f"[yellow]{service} {tracking_number} is already in your package list.[/]")
+
+@app.command("import")
+def command_import(
+    file: typing.Annotated[typing.Optional[Path], typer.Argument(help = "File to import from, reads from stdin if missing or '-'.", exists = True, dir_okay = False, allow_dash = True)] = None,
+    format: typing.Annotated[typing.Optional[OutputFormat], typer.Option(help = "Format of the file, guessed from its extension by default.")] = None,
+    track: typing.Annotated[bool, typer.Option(help = "Track the newly added packages right away.")] = False,
+) -> None:
+    """Add tracking numbers (and optionally names) from a CSV, JSON or JSONL file to your
+    package list."""
+    file = None if file is not None and str(file) == "-" else file
+    format = format or guess_format(file)
+
+    rows, invalid, duplicates = {}, [], 0
+    with file.open(newline = "") if file is not None else nullcontext(sys.stdin) as stream:
+        try:
+            for record in read_records(stream, format):
+                tracking_number = normalize(str(record.get("tracking_number") or ""))
+                if tracking_number in rows:
+                    duplicates += 1
+                    continue
+
+                if classify(tracking_number) is None:
+                    invalid.append(tracking_number)
+                    continue
+
+                rows[tracking_number] = (record.get("name") or "").strip() or None
+
+        except (csv.Error, ValueError, TypeError, AttributeError) as error:
+            console().print(f"[red]× Failed to read {file or 'stdin'} as {format.value}: {error}[/]")
+            raise typer.Exit(1)
+
+    for tracking_number in invalid:
+        console().print(f"[red]× {tracking_number or '(empty)'} is not a valid tracking number.[/]")
+
+    added, renamed = packages.merge(list(rows.items()))
+    console().print(
+        f"[green]✓ Added {len(added)} package{'s' if len(added) != 1 else ''} to your package list[/]"
+        f"[bright_black] ({len(renamed)} renamed, {len(rows) - len(added) - len(renamed)} unchanged, "
+        f"{duplicates} duplicate{'s' if duplicates != 1 else ''}, {len(invalid)} invalid)[/]"
+    )
+    if track and added:
+        show_packages({tracking_number: rows[tracking_number] for tracking_number in added}, None, True, None)
+
+@app.command("export")
+def command_export(
+    file: typing.Annotated[typing.Optional[Path], typer.Argument(help = "File to export to, writes to stdout if missing or '-'.")] = None,
+    format: typing.Annotated[typing.Optional[OutputFormat], typer.Option(help = "Format to export in, guessed from the file extension by default.")] = None,
+) -> None:
+    """Export your package list as CSV, JSON or JSONL."""
+    file = None if file is not None and str(file) == "-" else file
+    with file.open("w", newline = "") if file is not None else nullcontext(sys.stdout) as stream:
+        writer = RecordWriter(format or guess_format(file), LIST_FIELDS, stream)
+        for tracking_number, name in packages.load().items():
+            writer.write({"tracking_number": tracking_number, "name": name, "carrier": get_service(tracking_number)})
+
+        writer.close()
 
 @app.command("remove")
 def command_remove(tracking_numbers_or_names: list[str]) -> None:
     """Remove tracking numbers (or package names) from your package list."""
-    current_packages = packages.load()
-    names_to_numbers = {v: k for k, v in current_packages.items()}
-
-    for identifier in tracking_numbers_or_names:
-        identifier = names_to_numbers.get(identifier, identifier)
-        if identifier in current_packages:
-            del current_packages[identifier]
-            con.print(f"[green]✓ USPS {identifier} removed from your package list.[/]")
-
-    packages.save(current_packages)
+    for tracking_number in packages.remove(tracking_numbers_or_names):
+        console().print(f"[green]✓ {get_service(tracking_number)} {tracking_number} removed from your package list.[/]")
 
 @app.command("name")
 def command_name(
@@ -122,35 +431,49 @@ def command_name(
 ) -> None:
     """Assign a name to the given package, updating if it already has one. Package
     will be saved to the package list if it hasn't been added previously."""
-    original_packages = packages.load()
+    tracking_number = normalize(tracking_number)
+
+    # Packages saved before validation existed can still be renamed, new ones have to be valid
+    service = classify(tracking_number)
+    if service is None and tracking_number not in packages:
+        return console().print(f"[red]× {tracking_number} is not a valid tracking number.[/]")
+
+    service = service or get_service(tracking_number)
     if erase:
-        if tracking_number in original_packages:
-            return con.print(f"[green]✓ USPS {tracking_number}'s name has been erased.[/]")
+        if packages.name(tracking_number, None):
+            return console().print(f"[green]✓ {service} {tracking_number}'s name has been erased.[/]")
 
-        return con.print(f"[red]× USPS {tracking_number} is not in the package list.[/]")
+        return console().print(f"[red]× {service} {tracking_number} is not in the package list.[/]")
 
     if name is None:
-        name = con.input("[cyan]Choose a package name: ")
+        name = console().input("[cyan]Choose a package name: ")
         if not name.strip():
-            return con.print("[red]× Name cannot be an empty string.[/]")
+            return console().print("[red]× Name cannot be an empty string.[/]")
 
-    if tracking_number not in original_packages:
-        con.print(f"[green]✓ USPS {tracking_number} added to your package list with name [cyan]'{name}'[/].[/]")
+    if not packages.name(tracking_number, name):
+        console().print(f"[green]✓ {service} {tracking_number} added to your package list with name [cyan]'{name}'[/].[/]")
 
     else:
-        con.print(f"[green]✓ USPS {tracking_number} updated with name [cyan]'{name}'[/].[/]")
-
-    packages.save(original_packages | {tracking_number: name})
+        console().print(f"[green]✓ {service} {tracking_number} updated with name [cyan]'{name}'[/].[/]")
 
 @app.command("list")
-def command_list() -> None:
+def command_list(
+    format: typing.Annotated[typing.Optional[OutputFormat], typer.Option(help = "Output machine readable records instead of formatted text.")] = None,
+) -> None:
     """List everything stored in the saved package list."""
+    if format is not None:
+        writer = RecordWriter(format, LIST_FIELDS)
+        for tracking_number, name in packages.load().items():
+            writer.write({"tracking_number": tracking_number, "name": name, "carrier": get_service(tracking_number)})
+
+        return writer.close()
+
     tracked = {k: v or "N/A" for k, v in packages.load().items()}
     longest = max(len(name) for name in tracked.values())
     for tracking_number, name in tracked.items():
-        con.print(f"°︎ {name}:{' ' * (longest - len(name) + 1)}[cyan]{get_service(tracking_number)}[/] [bright_blue]{tracking_number}[/]")
+        console().print(f"°︎ {name}:{' ' * (longest - len(name) + 1)}[cyan]{get_service(tracking_number)}[/] [bright_blue]{tracking_number}[/]")
 
 @app.command("version")
 def command_version() -> None:
     """Show the CLI version."""
-    con.print(f"[cyan]USPS-cli v{__version__} by iiPython[/]\n -> [yellow]https://github.com/iiPythonx/usps")
+    console().print(f"[cyan]USPS-cli v{__version__} by iiPython[/]\n -> [yellow]https://github.com/iiPythonx/usps")
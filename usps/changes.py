@@ -0,0 +1,116 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import hashlib
+from datetime import datetime
+from dataclasses import dataclass
+from collections.abc import Iterable, Iterator
+
+from usps.storage import Database, chunked, database
+from usps.tracking import Package, Step, StatusNotAvailable, iter_packages
+
+# Typing
+@dataclass
+class Change:
+    tracking_number:    str
+    kind:               str             # Either "state" or "step"
+    state:              str
+    previous_state:     str | None
+    step:               Step | None
+
+    def to_dict(self) -> dict:
+        return {
+            "tracking_number": self.tracking_number,
+            "kind": self.kind,
+            "state": self.state,
+            "previous_state": self.previous_state,
+            "step": self.step and self.step.to_dict()
+        }
+
+# Main class
+class ChangeTracker:
+    def __init__(self, database: Database) -> None:
+        self.database = database
+        self.pending: dict[str, tuple[str, str | None, int, str]] = {}
+
+    @staticmethod
+    def digest(package: Package) -> str:
+        return hashlib.sha1("\n".join(
+            f"{step.details}\t{step.location}\t{step.time and step.time.isoformat()}" for step in package.steps
+        ).encode()).hexdigest()
+
+    def load(self, tracking_numbers: list[str]) -> dict[str, tuple[str, str | None, int, str]]:
+        seen = {}
+        for chunk in chunked(tracking_numbers):
+            seen |= {row[0]: row[1:] for row in self.database.connection.execute(
+                f"SELECT tracking_number, digest, latest, count, state FROM history WHERE tracking_number IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )}
+
+        return seen
+
+    def detect(self, tracking_number: str, package: Package) -> list[Change]:
+        return self.compare(tracking_number, package, self.load([tracking_number]).get(tracking_number))
+
+    def compare(self, tracking_number: str, package: Package, previous: tuple[str, str | None, int, str] | None) -> list[Change]:
+        digest = self.digest(package)
+        times = [step.time for step in package.steps if step.time is not None]
+        current = (digest, max(times).isoformat() if times else None, len(package.steps), package.state)
+        if current != previous:
+            self.pending[tracking_number] = current
+
+        # First time seeing this package, so the only thing to report is its state
+        if previous is None:
+            return [Change(tracking_number, "state", package.state, None, None)]
+
+        previous_digest, previous_latest, previous_count, previous_state = previous
+
+        changes = []
+        if previous_state != package.state:
+            changes.append(Change(tracking_number, "state", package.state, previous_state, None))
+
+        if previous_digest == digest:
+            return changes
+
+        # Steps are newest first, so anything newer than the last step we saw is new
+        new_steps = package.steps[:max(len(package.steps) - previous_count, 0)]
+        if previous_latest is not None:
+            latest = datetime.fromisoformat(previous_latest)
+            try:
+                new_steps = [step for step in package.steps if step.time is not None and step.time > latest]
+
+            except TypeError:  # Mixing naive and aware times, stick with the step count
+                pass
+
+        return changes + [Change(tracking_number, "step", package.state, previous_state, step) for step in new_steps]
+
+    def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        with self.database.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO history (tracking_number, digest, latest, count, state) VALUES (?, ?, ?, ?, ?)",
+                [(tracking_number, *entry) for tracking_number, entry in pending.items()]
+            )
+
+history = ChangeTracker(database)
+
+def iter_changes(
+    tracking_numbers: Iterable[str],
+    concurrency: dict[str, int] | None = None,
+    use_cache: bool = True,
+    max_age: float | None = None
+) -> Iterator[Change]:
+    tracking_numbers = list(tracking_numbers)
+    seen = history.load(tracking_numbers)
+    try:
+        for tracking_number, package in iter_packages(tracking_numbers, concurrency, use_cache, max_age):
+            if isinstance(package, StatusNotAvailable):
+                continue
+
+            yield from history.compare(tracking_number, package, seen.get(tracking_number))
+
+    finally:
+        history.flush()
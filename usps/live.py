@@ -0,0 +1,96 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+from datetime import datetime
+
+from rich import box
+from rich.table import Table
+from rich.console import Console, ConsoleOptions, RenderResult
+
+from usps.timezones import get_delta
+from usps.tracking import Package, StatusNotAvailable, get_service
+
+# Typing
+Result = Package | StatusNotAvailable | None
+
+# Main class
+# Keeps one prebuilt row per package, so redrawing only costs as much as the rows that changed
+class PackageTable:
+    def __init__(self, tracking_numbers: dict[str, str | None]) -> None:
+        self.names = tracking_numbers
+        self.results: dict[str, Result] = {}
+        self.rows: dict[str, list[str]] = {}
+        self.deltas: dict[str, str] = {}
+
+        for tracking_number in tracking_numbers:
+            self.rows[tracking_number] = self.__row(tracking_number, None)
+            self.deltas[tracking_number] = ""
+
+    @staticmethod
+    def __same(previous: Result, result: Result) -> bool:
+        if isinstance(previous, StatusNotAvailable) or isinstance(result, StatusNotAvailable):
+            return type(previous) is type(result) and str(previous) == str(result)
+
+        return previous == result
+
+    def __row(self, tracking_number: str, result: Result) -> list[str]:
+        name = self.names[tracking_number]
+        row = [
+            f"{name} [bright_black]({tracking_number})[/]" if name is not None else f"[bright_blue]{tracking_number}[/]",
+            f"[cyan]{get_service(tracking_number)}[/]"
+        ]
+        if result is None:
+            return row + ["[bright_black]Tracking...[/]", "", "", ""]
+
+        if isinstance(result, StatusNotAvailable):
+            return row + [f"[red]{result}[/]", "", "", ""]
+
+        latest = result.steps[0] if result.steps else None
+        expected = ""
+        if result.expected:
+            times = " - ".join(time.strftime("%I:%M %p") for time in result.expected)
+            expected = f"[green]{result.expected[0].strftime('%a %b %d')} {times}[/]"
+
+        elif result.state == "Delivered":
+            expected = "[green]Delivered[/]"
+
+        return row + [
+            f"[cyan]{result.state}[/]",
+            f"[cyan]{latest.details}[/]" if latest is not None else "",
+            f"[yellow]{latest.location}[/]" if latest is not None else "",
+            expected
+        ]
+
+    def __delta(self, tracking_number: str, now: datetime) -> str:
+        result = self.results.get(tracking_number)
+        if not isinstance(result, Package) or not result.steps or result.steps[0].time is None:
+            return ""
+
+        # Only the relative part fits in a table cell, the exact time is left for usps track
+        step = result.steps[0]
+        delta = get_delta(step.location, step.time, now).split("\t")[0]
+        return f"[bright_blue]{delta}[/]"
+
+    def update(self, tracking_number: str, result: Result, now: datetime) -> bool:
+        if tracking_number in self.results and self.__same(self.results[tracking_number], result):
+            return False
+
+        self.results[tracking_number] = result
+        self.rows[tracking_number] = self.__row(tracking_number, result)
+        self.deltas[tracking_number] = self.__delta(tracking_number, now)
+        return True
+
+    def tick(self, now: datetime) -> None:
+        # Relative times go stale even when nothing else changes, so those get redone once per pass
+        for tracking_number in self.rows:
+            self.deltas[tracking_number] = self.__delta(tracking_number, now)
+
+    def __rich_console__(self, console: Console, options: ConsoleOptions) -> RenderResult:
+        table = Table(box = box.SIMPLE_HEAD, header_style = "bold", pad_edge = False)
+        for column in ("Package", "Carrier", "State", "Latest step", "Location", "When", "Expected"):
+            table.add_column(column)
+
+        for tracking_number, (package, carrier, state, step, location, expected) in self.rows.items():
+            table.add_row(package, carrier, state, step, location, self.deltas[tracking_number], expected)
+
+        yield table
@@ -0,0 +1,86 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import re
+import json
+import time
+import typing
+from enum import Enum
+from threading import Lock
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+
+# Typing
+class MetricsFormat(str, Enum):
+    json = "json"
+    prometheus = "prometheus"
+
+# Main class
+class Metrics:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.counters: Counter[str] = Counter()
+        self.timers: dict[str, list[float]] = {}     # name -> [count, total, max]
+        self.lock = Lock()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] += amount
+
+    def observe(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def __timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timer(self, name: str) -> typing.ContextManager:
+        return self.__timer(name) if self.enabled else nullcontext()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {
+                    name: {"count": int(count), "total": total, "average": total / count if count else 0.0, "max": maximum}
+                    for name, (count, total, maximum) in self.timers.items()
+                }
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent = 4)
+
+    def to_prometheus(self) -> str:
+        def clean(name: str) -> str:
+            return "usps_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        snapshot, lines = self.snapshot(), []
+        for name, value in snapshot["counters"].items():
+            lines += [f"# TYPE {clean(name)}_total counter", f"{clean(name)}_total {value}"]
+
+        for name, timer in snapshot["timers"].items():
+            lines += [
+                f"# TYPE {clean(name)}_seconds summary",
+                f"{clean(name)}_seconds_count {timer['count']}",
+                f"{clean(name)}_seconds_sum {timer['total']}"
+            ]
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
@@ -0,0 +1,102 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import csv
+import sys
+import json
+import typing
+from enum import Enum
+from pathlib import Path
+from collections.abc import Iterator
+
+from usps.tracking import Package, StatusNotAvailable, get_service
+
+# Typing
+class OutputFormat(str, Enum):
+    jsonl = "jsonl"
+    json = "json"
+    csv = "csv"
+
+PACKAGE_FIELDS = ["tracking_number", "name", "carrier", "service", "state", "last_status", "expected", "steps", "error"]
+CHANGE_FIELDS = ["tracking_number", "name", "kind", "state", "previous_state", "step"]
+LIST_FIELDS = ["tracking_number", "name", "carrier"]
+
+# Record building
+def package_record(tracking_number: str, name: str | None, package: Package | StatusNotAvailable) -> dict:
+    record = {"tracking_number": tracking_number, "name": name, "carrier": get_service(tracking_number)}
+    if isinstance(package, StatusNotAvailable):
+        return record | {"error": str(package)}
+
+    return record | package.to_dict()
+
+def guess_format(file: Path | None) -> OutputFormat:
+    match file.suffix.lower() if file is not None else None:
+        case ".json":
+            return OutputFormat.json
+
+        case ".jsonl" | ".ndjson":
+            return OutputFormat.jsonl
+
+    # A plain list of numbers, one per line, reads just fine as a single column CSV
+    return OutputFormat.csv
+
+def read_records(stream: typing.TextIO, format: OutputFormat) -> Iterator[dict]:
+    match format:
+        case OutputFormat.csv:
+            rows = csv.reader(stream)
+            header = next(rows, None)
+            if header is None:
+                return
+
+            # Files without a header row are just tracking numbers, optionally followed by names
+            fields = header
+            if "tracking_number" not in header:
+                fields = ["tracking_number", "name"]
+                yield dict(zip(fields, header))
+
+            for row in rows:
+                if row:
+                    yield dict(zip(fields, row))
+
+        case OutputFormat.jsonl:
+            for line in stream:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record if isinstance(record, dict) else {"tracking_number": record}
+
+        case OutputFormat.json:
+            for record in json.load(stream):
+                yield record if isinstance(record, dict) else {"tracking_number": record}
+
+# Main class
+class RecordWriter:
+    def __init__(self, format: OutputFormat, fields: list[str], stream: typing.TextIO | None = None) -> None:
+        self.format, self.fields, self.stream = format, fields, stream if stream is not None else sys.stdout  # Looked up late so redirected stdout still works
+        self.count = 0
+
+        if format == OutputFormat.csv:
+            self.csv = csv.DictWriter(self.stream, fields)
+            self.csv.writeheader()
+
+    def write(self, record: dict) -> None:
+        record = {field: record.get(field) for field in self.fields}
+        match self.format:
+            case OutputFormat.jsonl:
+                self.stream.write(json.dumps(record) + "\n")
+
+            case OutputFormat.json:
+                self.stream.write(("[\n" if not self.count else ",\n") + json.dumps(record, indent = 4))
+
+            case OutputFormat.csv:
+                self.csv.writerow({
+                    key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                    for key, value in record.items()
+                })
+
+        self.count += 1
+        self.stream.flush()
+
+    def close(self) -> None:
+        if self.format == OutputFormat.json:
+            self.stream.write("\n]\n" if self.count else "[]\n")
+            self.stream.flush()
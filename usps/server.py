@@ -0,0 +1,209 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import json
+import asyncio
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from usps.output import PACKAGE_FIELDS, package_record
+from usps.tracking import Package, StatusNotAvailable, classify, get_service, track_packages_async
+from usps.tracking.numbers import normalize
+from usps.tracking.cache import cache
+from usps.tracking.steps import UNKNOWN_STEPS
+from usps.tracking.transport import close_async_clients
+
+# Limits
+MAX_BODY_SIZE = 1024 * 1024
+MAX_BATCH_SIZE = 500
+REQUEST_TIMEOUT = 30        # Seconds a client gets to send each request, so idle connections don't stay open forever
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+def record(tracking_number: str, package: Package | StatusNotAvailable) -> dict:
+    record = package_record(tracking_number, None, package)
+    return {field: record.get(field) for field in PACKAGE_FIELDS}
+
+# Exceptions
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+# Main class
+class TrackingServer:
+    def __init__(self, concurrency: dict[str, int] | None = None) -> None:
+        self.concurrency = concurrency
+        self.inflight: dict[str, asyncio.Future] = {}
+
+        # The event loop only keeps weak references to tasks, so hold on to fetches until they finish
+        self.tasks: set[asyncio.Task] = set()
+
+    async def __fetch(self, tracking_numbers: list[str], futures: dict[str, asyncio.Future]) -> None:
+        try:
+            results = await track_packages_async(tracking_numbers, self.concurrency, False)
+            for tracking_number, future in futures.items():
+                if not future.done():
+                    future.set_result(results[tracking_number])
+
+        except Exception as failure:  # Anything unexpected gets handed to everybody waiting on it
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(failure)
+
+        finally:
+            for tracking_number, future in futures.items():
+                if self.inflight.get(tracking_number) is future:
+                    del self.inflight[tracking_number]
+
+    async def track(
+        self,
+        tracking_numbers: list[str],
+        use_cache: bool = True,
+        max_age: float | None = None
+    ) -> dict[str, Package | StatusNotAvailable]:
+        tracking_numbers = list(dict.fromkeys(tracking_numbers))
+        cached = await asyncio.to_thread(cache.get_many, tracking_numbers, max_age) if use_cache else {}
+
+        # Anything already being fetched upstream just waits on that fetch instead of starting another
+        loop, waiting, started = asyncio.get_running_loop(), {}, {}
+        for tracking_number in tracking_numbers:
+            if tracking_number in cached:
+                continue
+
+            if tracking_number not in self.inflight:
+                started[tracking_number] = self.inflight[tracking_number] = loop.create_future()
+
+            waiting[tracking_number] = self.inflight[tracking_number]
+
+        if started:
+            task = loop.create_task(self.__fetch(list(started), started))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        # Shielded, so a caller going away doesn't cancel the fetch for everybody else waiting on it
+        results = cached | {tracking_number: await asyncio.shield(future) for tracking_number, future in waiting.items()}
+        return {tracking_number: results[tracking_number] for tracking_number in tracking_numbers}
+
+    @staticmethod
+    def __options(query: dict[str, list[str]]) -> tuple[bool, float | None]:
+        try:
+            use_cache = query.get("cache", ["true"])[-1].lower() not in ("0", "false", "no")
+            max_age = float(query["max_age"][-1]) * 60 if "max_age" in query else None
+            return use_cache, max_age
+
+        except ValueError:
+            raise HTTPError(400, "max_age must be a number of minutes")
+
+    async def route(self, method: str, target: str, body: bytes) -> dict | list:
+        url = urlsplit(target)
+        path, query = [unquote(part) for part in url.path.strip("/").split("/")], parse_qs(url.query)
+        match path:
+            case ["health"]:
+                return {
+                    "status": "ok",
+                    "inflight": len(self.inflight),
+                    "unknown_steps": [
+                        {"carrier": carrier, "details": details, "count": count}
+                        for (carrier, details), count in UNKNOWN_STEPS.most_common(20)
+                    ]
+                }
+
+            case ["service", tracking_number]:
+                tracking_number = normalize(tracking_number)
+                return {"tracking_number": tracking_number, "carrier": get_service(tracking_number), "valid": classify(tracking_number) is not None}
+
+            case ["track", tracking_number] if method == "GET":
+                tracking_number = normalize(tracking_number)
+                results = await self.track([tracking_number], *self.__options(query))
+                return record(tracking_number, results[tracking_number])
+
+            case ["track"] if method == "POST":
+                try:
+                    data = json.loads(body or b"null")
+
+                except ValueError:
+                    raise HTTPError(400, "Request body must be JSON")
+
+                tracking_numbers = data.get("tracking_numbers") if isinstance(data, dict) else data
+                if not isinstance(tracking_numbers, list) or not all(isinstance(number, str) for number in tracking_numbers):
+                    raise HTTPError(400, "Expected a list of tracking numbers")
+
+                if len(tracking_numbers) > MAX_BATCH_SIZE:
+                    raise HTTPError(413, f"Only {MAX_BATCH_SIZE} tracking numbers can be tracked at once")
+
+                results = await self.track([normalize(number) for number in tracking_numbers], *self.__options(query))
+                return [record(tracking_number, package) for tracking_number, package in results.items()]
+
+            case ["track"] | ["track", _]:
+                raise HTTPError(405, f"{method} is not supported here")
+
+        raise HTTPError(404, f"Nothing lives at /{'/'.join(path)}")
+
+    @staticmethod
+    async def __read_head(reader: asyncio.StreamReader) -> tuple[bytes, dict[str, str]]:
+        request_line, headers = await reader.readline(), {}
+        if request_line:
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        return request_line, headers
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line, headers = await asyncio.wait_for(self.__read_head(reader), REQUEST_TIMEOUT)
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY_SIZE:
+                        version = "HTTP/1.0"    # The body never gets read, so the connection can't be reused
+                        raise HTTPError(413, "Request body is too large")
+
+                    status, payload = 200, await self.route(method, target, await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT))
+
+                except HTTPError as error:
+                    status, payload = error.status, {"error": str(error)}
+
+                except ValueError:
+                    status, payload, version = 400, {"error": "Malformed request"}, "HTTP/1.0"
+
+                except Exception as failure:  # Keep the server alive no matter what a carrier throws at us
+                    status, payload = 500, {"error": str(failure)}
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                content = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + content
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+async def serve(host: str, port: int, concurrency: dict[str, int] | None = None) -> None:
+    server = await asyncio.start_server(TrackingServer(concurrency).handle, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+
+    finally:
+        await close_async_clients()
@@ -3,24 +3,212 @@
 # Modules
 import sys
 import json
+import time
+import sqlite3
+import threading
 from pathlib import Path
+from contextlib import contextmanager
+from collections.abc import Iterable, Iterator
 
 # Initialization
 usps_global = Path.home() / (".local/share" if sys.platform == "linux" else "AppData/Roaming") / "usps"
 usps_global.mkdir(exist_ok = True, parents = True)
 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    tracking_number TEXT PRIMARY KEY,
+    name            TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+
+CREATE TABLE IF NOT EXISTS cookies (
+    name            TEXT PRIMARY KEY,
+    value           TEXT NOT NULL,
+    expires         REAL
+);
+
+CREATE TABLE IF NOT EXISTS cache (
+    tracking_number TEXT PRIMARY KEY,
+    fetched         REAL NOT NULL,
+    state           TEXT NOT NULL,
+    package         TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    tracking_number TEXT PRIMARY KEY,
+    digest          TEXT NOT NULL,
+    latest          TEXT,
+    count           INTEGER NOT NULL,
+    state           TEXT NOT NULL
+);
+"""
+
+# Cookies living shorter than this (analytics and the like) aren't part of the USPS challenge,
+# so their expiry is ignored when deciding whether the saved cookies are still good
+MIN_COOKIE_LIFETIME = 600
+
+# SQLite won't take more than 999 parameters in a single query on older builds
+MAX_PARAMETERS = 900
+
+def chunked(items: list, size: int = MAX_PARAMETERS) -> Iterator[list]:
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+# Handle the database itself
+class Database:
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self.__local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.file, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self.__local.connection = connection
+            self.__migrate()
+
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def __migrate(self) -> None:
+        def read(filename: str) -> dict | None:
+            file = self.file.parent / filename
+            if not file.is_file():
+                return None
+
+            data = json.loads(file.read_text())
+            file.rename(file.with_suffix(".json.bak"))
+            return data
+
+        # Bring over anything left behind by the JSON based storage
+        if not any((self.file.parent / filename).is_file() for filename in ("packages.json", "security.json")):
+            return
+
+        with self.transaction() as connection:
+            tracked = read("packages.json")
+            if tracked is not None:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO packages (tracking_number, name) VALUES (?, ?)",
+                    tracked.items()
+                )
+
+            cookies = read("security.json")
+            if cookies is not None:
+                if "cookies" not in cookies:
+                    cookies = {"cookies": cookies, "expires": None}
+
+                connection.executemany(
+                    "INSERT OR REPLACE INTO cookies (name, value, expires) VALUES (?, ?, ?)",
+                    [(name, value, cookies["expires"]) for name, value in cookies["cookies"].items()]
+                )
+
 # Handle storage of everything
-class Storage:
-    def __init__(self, filename: str) -> None:
-        self.file = usps_global / filename
-        
+class PackageStorage:
+    def __init__(self, database: Database) -> None:
+        self.database = database
+
     def load(self) -> dict[str, str | None]:
-        if not self.file.is_file():
-            return {}
+        return dict(self.database.connection.execute("SELECT tracking_number, name FROM packages ORDER BY rowid"))
+
+    def add(self, tracking_numbers: Iterable[str | tuple[str, str | None]]) -> list[str]:
+        rows = [(number, None) if isinstance(number, str) else number for number in tracking_numbers]
+        with self.database.transaction() as connection:
+            added = []
+            for tracking_number, name in rows:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO packages (tracking_number, name) VALUES (?, ?)",
+                    (tracking_number, name)
+                )
+                if cursor.rowcount:
+                    added.append(tracking_number)
+
+            return added
+
+    def merge(self, rows: list[tuple[str, str | None]]) -> tuple[list[str], list[str]]:
+        with self.database.transaction() as connection:
+            existing = {}
+            for chunk in chunked([tracking_number for tracking_number, _ in rows]):
+                existing |= dict(connection.execute(
+                    f"SELECT tracking_number, name FROM packages WHERE tracking_number IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ))
+
+            # New packages get added, existing ones only change if they were given a different name
+            added = [(tracking_number, name) for tracking_number, name in rows if tracking_number not in existing]
+            renamed = [
+                (name, tracking_number) for tracking_number, name in rows
+                if tracking_number in existing and name is not None and existing[tracking_number] != name
+            ]
+            connection.executemany("INSERT INTO packages (tracking_number, name) VALUES (?, ?)", added)
+            connection.executemany("UPDATE packages SET name = ? WHERE tracking_number = ?", renamed)
+            return [tracking_number for tracking_number, _ in added], [tracking_number for _, tracking_number in renamed]
+
+    def remove(self, tracking_numbers_or_names: Iterable[str]) -> list[str]:
+        with self.database.transaction() as connection:
+            removed = []
+            for identifier in tracking_numbers_or_names:
+                matches = connection.execute(
+                    "SELECT tracking_number FROM packages WHERE tracking_number = ? OR name = ?",
+                    (identifier, identifier)
+                ).fetchall()
+                connection.executemany("DELETE FROM packages WHERE tracking_number = ?", matches)
+                removed += [tracking_number for (tracking_number,) in matches]
+
+            return removed
+
+    def name(self, tracking_number: str, name: str | None) -> bool:
+        with self.database.transaction() as connection:
+            exists = connection.execute(
+                "UPDATE packages SET name = ? WHERE tracking_number = ?",
+                (name, tracking_number)
+            ).rowcount
+            if not exists and name is not None:
+                connection.execute("INSERT INTO packages (tracking_number, name) VALUES (?, ?)", (tracking_number, name))
+
+            return bool(exists)
+
+    def __contains__(self, tracking_number: str) -> bool:
+        return self.database.connection.execute(
+            "SELECT 1 FROM packages WHERE tracking_number = ?",
+            (tracking_number,)
+        ).fetchone() is not None
+
+class CookieStorage:
+    def __init__(self, database: Database) -> None:
+        self.database = database
+
+    def load(self) -> tuple[dict[str, str], float | None]:
+        rows = self.database.connection.execute("SELECT name, value, expires FROM cookies").fetchall()
+        expiries = [expires for _, _, expires in rows if expires is not None]
+        return {name: value for name, value, _ in rows}, min(expiries) if expiries else None
+
+    def save(self, cookies: list[dict]) -> None:
+        now, rows = time.time(), []
+        for cookie in cookies:
+            expiry = cookie.get("expiry")
+            if expiry is not None and expiry - now < MIN_COOKIE_LIFETIME:
+                expiry = None
 
-        return json.loads(self.file.read_text())
+            rows.append((cookie["name"], cookie["value"], expiry))
 
-    def save(self, data: dict[str, str | None]) -> None:
-        self.file.write_text(json.dumps(data, indent = 4))
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM cookies")
+            connection.executemany("INSERT INTO cookies (name, value, expires) VALUES (?, ?, ?)", rows)
 
-packages, security = Storage("packages.json"), Storage("security.json")
+database = Database(usps_global / "usps.db")
+packages, security = PackageStorage(database), CookieStorage(database)
@@ -1,90 +1,145 @@
 # Copyright (c) 2024 iiPython
 
 # Modules
+import functools
 from zoneinfo import ZoneInfo
-from datetime import datetime
+from datetime import datetime, tzinfo
+from collections.abc import Iterable
 
 # Timezones
 TIMEZONE_MAPPING = {
-    "AL": ZoneInfo("US/Central"),
-    "AK": ZoneInfo("US/Alaska"),    # Also HST
-    "AZ": ZoneInfo("US/Mountain"),
-    "AR": ZoneInfo("US/Central"),
-    "CA": ZoneInfo("US/Pacific"),
-    "CO": ZoneInfo("US/Mountain"),
-    "CT": ZoneInfo("US/Eastern"),
-    "DE": ZoneInfo("US/Eastern"),
-    "FL": ZoneInfo("US/Eastern"),   # Also CST
-    "GA": ZoneInfo("US/Eastern"),
-    "HI": ZoneInfo("US/Hawaii"),
-    "ID": ZoneInfo("US/Mountain"),  # Also PST
-    "IL": ZoneInfo("US/Central"),
-    "IN": ZoneInfo("US/Eastern"),   # Also CST
-    "IA": ZoneInfo("US/Central"),
-    "KS": ZoneInfo("US/Central"),   # Also MST
-    "KY": ZoneInfo("US/Eastern"),   # Also CST
-    "LA": ZoneInfo("US/Central"),
-    "ME": ZoneInfo("US/Eastern"),
-    "MD": ZoneInfo("US/Eastern"),
-    "MA": ZoneInfo("US/Eastern"),
-    "MI": ZoneInfo("US/Eastern"),   # Also CST
-    "MN": ZoneInfo("US/Central"),
-    "MS": ZoneInfo("US/Central"),
-    "MO": ZoneInfo("US/Central"),
-    "MT": ZoneInfo("US/Mountain"),
-    "NE": ZoneInfo("US/Central"),   # Also MST
-    "NV": ZoneInfo("US/Pacific"),   # Also MST
-    "NH": ZoneInfo("US/Eastern"),
-    "NJ": ZoneInfo("US/Eastern"),
-    "NM": ZoneInfo("US/Mountain"),
-    "NY": ZoneInfo("US/Eastern"),
-    "NC": ZoneInfo("US/Eastern"),
-    "ND": ZoneInfo("US/Central"),   # Also MST
-    "OH": ZoneInfo("US/Eastern"),
-    "OK": ZoneInfo("US/Central"),
-    "OR": ZoneInfo("US/Pacific"),   # My hometown was MST lmao
-    "PA": ZoneInfo("US/Eastern"),
-    "RI": ZoneInfo("US/Eastern"),
-    "SC": ZoneInfo("US/Eastern"),
-    "SD": ZoneInfo("US/Central"),   # 50/50 with MST
-    "TN": ZoneInfo("US/Central"),   # Also EST
-    "TX": ZoneInfo("US/Central"),   # Also MST
-    "UT": ZoneInfo("US/Mountain"),
-    "VT": ZoneInfo("US/Eastern"),
-    "VA": ZoneInfo("US/Eastern"),
-    "WA": ZoneInfo("US/Pacific"),
-    "WV": ZoneInfo("US/Eastern"),
-    "WI": ZoneInfo("US/Central"),
-    "WY": ZoneInfo("US/Mountain")
+    "AL": "US/Central",
+    "AK": "US/Alaska",    # Also HST
+    "AZ": "America/Phoenix", # No DST, outside of the Navajo Nation
+    "AR": "US/Central",
+    "CA": "US/Pacific",
+    "CO": "US/Mountain",
+    "CT": "US/Eastern",
+    "DC": "US/Eastern",
+    "DE": "US/Eastern",
+    "FL": "US/Eastern",   # Also CST
+    "GA": "US/Eastern",
+    "HI": "US/Hawaii",
+    "ID": "US/Mountain",  # Also PST
+    "IL": "US/Central",
+    "IN": "US/Eastern",   # Also CST
+    "IA": "US/Central",
+    "KS": "US/Central",   # Also MST
+    "KY": "US/Eastern",   # Also CST
+    "LA": "US/Central",
+    "ME": "US/Eastern",
+    "MD": "US/Eastern",
+    "MA": "US/Eastern",
+    "MI": "US/Eastern",   # Also CST
+    "MN": "US/Central",
+    "MS": "US/Central",
+    "MO": "US/Central",
+    "MT": "US/Mountain",
+    "NE": "US/Central",   # Also MST
+    "NV": "US/Pacific",   # Also MST
+    "NH": "US/Eastern",
+    "NJ": "US/Eastern",
+    "NM": "US/Mountain",
+    "NY": "US/Eastern",
+    "NC": "US/Eastern",
+    "ND": "US/Central",   # Also MST
+    "OH": "US/Eastern",
+    "OK": "US/Central",
+    "OR": "US/Pacific",   # My hometown was MST lmao
+    "PA": "US/Eastern",
+    "RI": "US/Eastern",
+    "SC": "US/Eastern",
+    "SD": "US/Central",   # 50/50 with MST
+    "TN": "US/Central",   # Also EST
+    "TX": "US/Central",   # Also MST
+    "UT": "US/Mountain",
+    "VT": "US/Eastern",
+    "VA": "US/Eastern",
+    "WA": "US/Pacific",
+    "WV": "US/Eastern",
+    "WI": "US/Central",
+    "WY": "US/Mountain",
+
+    # Territories
+    "AS": "Pacific/Pago_Pago",
+    "GU": "Pacific/Guam",
+    "MP": "Pacific/Saipan",
+    "PR": "America/Puerto_Rico",
+    "VI": "America/St_Thomas"
 }
+
+# Cities sitting on the other side of a state's time zone line
+CITY_TIMEZONE_MAPPING = {
+    ("AK", "ADAK"):               "US/Aleutian",
+    ("FL", "PENSACOLA"):          "US/Central",
+    ("FL", "PANAMA CITY"):        "US/Central",
+    ("FL", "FORT WALTON BEACH"):  "US/Central",
+    ("ID", "COEUR D'ALENE"):      "US/Pacific",
+    ("ID", "LEWISTON"):           "US/Pacific",
+    ("ID", "MOSCOW"):             "US/Pacific",
+    ("IN", "GARY"):               "US/Central",
+    ("IN", "HAMMOND"):            "US/Central",
+    ("IN", "EVANSVILLE"):         "US/Central",
+    ("KS", "GOODLAND"):           "US/Mountain",
+    ("KY", "BOWLING GREEN"):      "US/Central",
+    ("KY", "PADUCAH"):            "US/Central",
+    ("KY", "OWENSBORO"):          "US/Central",
+    ("MI", "IRON MOUNTAIN"):      "US/Central",
+    ("MI", "MENOMINEE"):          "US/Central",
+    ("ND", "DICKINSON"):          "US/Mountain",
+    ("ND", "WILLISTON"):          "US/Mountain",
+    ("NE", "SCOTTSBLUFF"):        "US/Mountain",
+    ("NE", "SIDNEY"):             "US/Mountain",
+    ("NV", "WEST WENDOVER"):      "US/Mountain",
+    ("OR", "ONTARIO"):            "US/Mountain",
+    ("SD", "RAPID CITY"):         "US/Mountain",
+    ("SD", "SPEARFISH"):          "US/Mountain",
+    ("TN", "KNOXVILLE"):          "US/Eastern",
+    ("TN", "CHATTANOOGA"):        "US/Eastern",
+    ("TN", "JOHNSON CITY"):       "US/Eastern",
+    ("TX", "EL PASO"):            "US/Mountain"
+}
+
 LOCAL_TIMEZONE = datetime.now().astimezone().tzinfo
 
+# Zones are only loaded from disk the first time they actually show up
+@functools.cache
+def get_timezone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+# Tracking lists keep showing the same handful of locations, so remember where each one is
+@functools.lru_cache(maxsize = 4096)
+def resolve_timezone(location: str) -> tzinfo | None:
+    chunks = location.replace("\xa0", " ").split(" ")
+    for index in range(len(chunks) - 1, -1, -1):
+        state = chunks[index]
+        if state in TIMEZONE_MAPPING:
+            city = " ".join(chunks[:index]).rstrip(",").strip()
+            return get_timezone(CITY_TIMEZONE_MAPPING.get((state, city), TIMEZONE_MAPPING[state]))
+
+    return None
+
 # Actual utilities
 def pluralize(item: int) -> str:
     return "s" if item > 1 else ""
 
-def get_delta(location: str, time: datetime) -> str:
-    state, original_time, zeroed = None, None, time.second == 0 and time.minute == 0 and time.hour == 0
+@functools.lru_cache(maxsize = 4096)
+def format_time(time: datetime, known: bool) -> str:
+    return time.strftime(f"%D %I:%M{':%S' if time.second else ''} %p {LOCAL_TIMEZONE if known else 'N/A'}")
 
-    # Calculate the timezone for the given location
-    if time.tzinfo is not None and time.tzinfo.utcoffset(time) is not None:
-        original_time, time = time, time.astimezone(LOCAL_TIMEZONE)
+def get_delta(location: str, time: datetime, now: datetime | None = None) -> str:
+    zeroed = time.second == 0 and time.minute == 0 and time.hour == 0
 
-    else:
-        chunks = location.encode().replace(b"\xc2\xa0", b" ").decode().split(" ")
-        for chunk in chunks:
-            if chunk in TIMEZONE_MAPPING:
-                state = chunk
-
-        if state in TIMEZONE_MAPPING:
-            original_time = time.replace(tzinfo = TIMEZONE_MAPPING[state])
-            time = original_time.astimezone(LOCAL_TIMEZONE)
-
-        else:
-            time = time.astimezone(LOCAL_TIMEZONE)
+    # Calculate the timezone for the given location
+    known = time.tzinfo is not None and time.tzinfo.utcoffset(time) is not None
+    if not known:
+        zone = resolve_timezone(location)
+        if zone is not None:
+            time, known = time.replace(tzinfo = zone), True
 
-    delta = datetime.now(LOCAL_TIMEZONE) - time
-    time_string = time.strftime(f"%D %I:%M{':%S' if time.second else ''} %p {LOCAL_TIMEZONE if original_time else 'N/A'}")
+    time = time.astimezone(LOCAL_TIMEZONE)
+    delta = (now or datetime.now(LOCAL_TIMEZONE)) - time
+    time_string = format_time(time, known)
 
     # If it's perfectly midnight, assume this is an untimed step
     if zeroed:
@@ -114,3 +169,7 @@ def get_delta(location: str, time: datetime) -> str:
 
     else:
         return f"{delta.seconds} second{pluralize(delta.seconds)} ago\t({time_string})"
+
+def get_deltas(steps: Iterable[tuple[str, datetime | None]], now: datetime | None = None) -> list[str]:
+    now = now or datetime.now(LOCAL_TIMEZONE)
+    return [get_delta(location, time, now) if time is not None else "" for location, time in steps]
@@ -3,19 +3,35 @@
 # Modules
 import os
 import re
+import sys
+import functools
+import importlib
 from datetime import datetime
 from dataclasses import dataclass
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from requests import Session
+from usps.metrics import metrics
 
 # Typing
-@dataclass
+# Step names and locations repeat constantly between packages, so only keep one copy of each around
+@dataclass(slots = True)
 class Step:
     details:    str
     location:   str
     time:       datetime | None
 
-@dataclass
+    def __post_init__(self) -> None:
+        self.details, self.location = sys.intern(self.details), sys.intern(self.location)
+
+    def to_dict(self) -> dict:
+        return {"details": self.details, "location": self.location, "time": self.time and self.time.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Step":
+        return cls(data["details"], data["location"], data["time"] and datetime.fromisoformat(data["time"]))
+
+@dataclass(slots = True)
 class Package:
     expected:       list[datetime] | None
     last_status:    str | None
@@ -23,6 +39,32 @@ class Package:
     steps:          list[Step]
     service:        str | None
 
+    def __post_init__(self) -> None:
+        if self.state is not None:
+            self.state = sys.intern(self.state)
+
+        if self.service is not None:
+            self.service = sys.intern(self.service)
+
+    def to_dict(self) -> dict:
+        return {
+            "expected": [time.isoformat() for time in self.expected] if self.expected is not None else None,
+            "last_status": self.last_status,
+            "state": self.state,
+            "steps": [step.to_dict() for step in self.steps],
+            "service": self.service
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Package":
+        return cls(
+            [datetime.fromisoformat(time) for time in data["expected"]] if data["expected"] is not None else None,
+            data["last_status"],
+            data["state"],
+            [Step.from_dict(step) for step in data["steps"]],
+            data["service"]
+        )
+
 # Global exceptions
 class StatusNotAvailable(Exception):
     pass
@@ -34,28 +76,227 @@ os.environ["SE_AVOID_STATS"] = "true"
 # Constants
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.3"
 
-SESSION = Session()
-SESSION.headers.update({
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "Accept-Language": "en-US,en;q=0.5",
-    "Sec-Fetch-Dest": "document",
-    "Sec-Fetch-Site": "none",
-    "Sec-Fetch-User": "?1",
-    "Sec-GPC": "1",
-    "User-Agent": USER_AGENT,
-})
+# Progress output (like the cookie spinner) is only for humans, machine readable output turns it off
+PROGRESS = {"enabled": True}
+
+def configure_progress(enabled: bool) -> None:
+    PROGRESS["enabled"] = enabled
 
 # Handle actual tracking
-from .ups import UPSTracking    # noqa: E402
-from .usps import USPSTracking  # noqa: E402
+from .cache import cache                        # noqa: E402
+from .transport import ensure_pool_size         # noqa: E402
+from .numbers import UPS_PATTERNS, USPS_PATTERNS, ups_checksum, usps_checksum  # noqa: E402
+
+# Handle carrier registration
+# Carriers are registered by import path, since their modules pull in requests, selectolax
+# and friends, which we only want to load once a package from that carrier shows up
+@dataclass(frozen = True)
+class CarrierEntry:
+    name:       str
+    path:       str                     # module:Class implementing usps.tracking.carrier.Carrier
+    patterns:   tuple[re.Pattern, ...]
+    validator:  Callable[[str], bool] | None
+
+CARRIERS: dict[str, CarrierEntry] = {}
+DEFAULT_CARRIER = "USPS"                # USPS formats are all over the place, so it gets anything unclaimed
 
-UPS_PACKAGE_REGEX = re.compile(r"^1Z[A-Z0-9]{6}[0-9]{10}$")
+def register_carrier(name: str, path: str, patterns: Iterable[str] = (), validator: Callable[[str], bool] | None = None) -> None:
+    CARRIERS[name] = CarrierEntry(name, path, tuple(re.compile(pattern) for pattern in patterns), validator)
+    get_carrier.cache_clear()
+    classify.cache_clear()
 
 def get_service(tracking_number: str) -> str:
-    if re.match(UPS_PACKAGE_REGEX, tracking_number):
-        return "UPS"
+    for carrier in CARRIERS.values():
+        if any(pattern.match(tracking_number) for pattern in carrier.patterns):
+            return carrier.name
+
+    return DEFAULT_CARRIER
+
+# Catch typos (and other carriers) before they cost a page fetch or a round of cookie generation
+@functools.lru_cache(maxsize = 4096)
+def classify(tracking_number: str) -> str | None:
+    for carrier in CARRIERS.values():
+        if any(pattern.match(tracking_number) for pattern in carrier.patterns):
+            return carrier.name if carrier.validator is None or carrier.validator(tracking_number) else None
+
+    return None
+
+def classify_many(tracking_numbers: Iterable[str]) -> dict[str, str | None]:
+    return {tracking_number: classify(tracking_number) for tracking_number in dict.fromkeys(tracking_numbers)}
+
+def invalid_number() -> StatusNotAvailable:
+    return StatusNotAvailable("Not a valid tracking number, check it for typos")
+
+# One package failing in some unexpected way (Selenium timing out, a page we can't parse)
+# shouldn't take the rest of the list, or a long running watch/serve, down with it
+def tracking_failed(error: Exception) -> StatusNotAvailable:
+    return StatusNotAvailable(f"Tracking failed unexpectedly ({type(error).__name__}: {error})")
+
+@functools.cache
+def get_carrier(service: str) -> type:
+    if service not in CARRIERS:
+        raise ValueError(f"Unknown service: {service}")
+
+    module, _, name = CARRIERS[service].path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+register_carrier("UPS", "usps.tracking.ups:UPSTracking", UPS_PATTERNS, ups_checksum)
+register_carrier("USPS", "usps.tracking.usps:USPSTracking", USPS_PATTERNS, usps_checksum)
+
+def track_package(tracking_number: str, use_cache: bool = True, max_age: float | None = None) -> Package:
+    if use_cache:
+        package = cache.get(tracking_number, max_age)
+        metrics.count("cache.hits" if package is not None else "cache.misses")
+        if package is not None:
+            return package
+
+    service = classify(tracking_number)
+    if service is None:
+        raise invalid_number()
+
+    package = get_carrier(service).track_package(tracking_number)
+    cache.put(tracking_number, package)
+    cache.flush()
+    return package
+
+async def track_package_async(tracking_number: str, use_cache: bool = True, max_age: float | None = None) -> Package:
+    result = (await track_packages_async([tracking_number], None, use_cache, max_age))[tracking_number]
+    if isinstance(result, StatusNotAvailable):
+        raise result
+
+    return result
+
+# Handle bulk tracking
+CONCURRENCY = {"UPS": 4, "USPS": 4}
+DEFAULT_CONCURRENCY = 4
+
+def _track_uncached(service: str, tracking_numbers: list[str]) -> dict[str, Package | StatusNotAvailable]:
+    try:
+        results = get_carrier(service).track_packages(tracking_numbers)
+
+    except Exception as error:  # Carriers handle their own expected failures, this is everything else
+        results = {tracking_number: tracking_failed(error) for tracking_number in tracking_numbers}
+
+    for tracking_number, package in results.items():
+        if isinstance(package, Package):
+            cache.put(tracking_number, package)
+
+    return results
+
+def _group_packages(
+    tracking_numbers: Iterable[str],
+    use_cache: bool,
+    max_age: float | None
+) -> tuple[list[str], dict[str, Package | StatusNotAvailable], dict[str, list[str]]]:
+    services = classify_many(tracking_numbers)
+    tracking_numbers = list(services)
+
+    # Group everything by carrier, so carriers with a bulk API get as few requests as possible
+    valid = [tracking_number for tracking_number, service in services.items() if service is not None]
+    cached = cache.get_many(valid, max_age) if use_cache else {}
+    if use_cache:
+        metrics.count("cache.hits", len(cached))
+        metrics.count("cache.misses", len(valid) - len(cached))
+
+    grouped: dict[str, list[str]] = {}
+    for tracking_number in valid:
+        if tracking_number not in cached:
+            grouped.setdefault(services[tracking_number], []).append(tracking_number)
+
+    # Invalid numbers are answered right away, same as anything in the cache
+    metrics.count("numbers.invalid", len(tracking_numbers) - len(valid))
+    return tracking_numbers, cached | {
+        tracking_number: invalid_number()
+        for tracking_number, service in services.items() if service is None
+    }, grouped
+
+def iter_packages(
+    tracking_numbers: Iterable[str],
+    concurrency: dict[str, int] | None = None,
+    use_cache: bool = True,
+    max_age: float | None = None
+) -> Iterator[tuple[str, Package | StatusNotAvailable]]:
+    # Results come back in the order given, as soon as each one (and everything before it) resolves
+    limits = CONCURRENCY | (concurrency or {})
+    tracking_numbers, resolved, grouped = _group_packages(tracking_numbers, use_cache, max_age)
+
+    # Keep enough connections alive for every worker, otherwise they'd just get thrown away
+    pools = {}
+    for service in grouped:
+        limit = max(limits.get(service, DEFAULT_CONCURRENCY), 1)
+        ensure_pool_size(service, limit)
+        pools[service] = ThreadPoolExecutor(max_workers = limit)
+
+    try:
+        futures: dict[str, Future] = {}
+        for service, numbers in grouped.items():
+            size = get_carrier(service).BATCH_SIZE
+            for index in range(0, len(numbers), size):
+                chunk = numbers[index:index + size]
+                future = pools[service].submit(_track_uncached, service, chunk)
+                futures |= {tracking_number: future for tracking_number in chunk}
+
+        for tracking_number in tracking_numbers:
+            if tracking_number in resolved:
+                yield tracking_number, resolved[tracking_number]
+                continue
+
+            yield tracking_number, futures[tracking_number].result()[tracking_number]
+
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait = False, cancel_futures = True)
+
+        cache.flush()
+
+def track_packages(
+    tracking_numbers: Iterable[str],
+    concurrency: dict[str, int] | None = None,
+    use_cache: bool = True,
+    max_age: float | None = None
+) -> dict[str, Package | StatusNotAvailable]:
+    return dict(iter_packages(tracking_numbers, concurrency, use_cache, max_age))
+
+async def track_packages_async(
+    tracking_numbers: Iterable[str],
+    concurrency: dict[str, int] | None = None,
+    use_cache: bool = True,
+    max_age: float | None = None
+) -> dict[str, Package | StatusNotAvailable]:
+    import asyncio
+
+    limits = CONCURRENCY | (concurrency or {})
+    tracking_numbers, resolved, grouped = _group_packages(tracking_numbers, use_cache, max_age)
+
+    async def track_chunk(service: str, chunk: list[str], semaphore: asyncio.Semaphore) -> dict[str, Package | StatusNotAvailable]:
+        async with semaphore:
+            try:
+                results = await get_carrier(service).track_packages_async(chunk)
+
+            except Exception as error:  # Carriers handle their own expected failures, this is everything else
+                results = {tracking_number: tracking_failed(error) for tracking_number in chunk}
+
+        for tracking_number, package in results.items():
+            if isinstance(package, Package):
+                cache.put(tracking_number, package)
+
+        return results
+
+    # Everything shares the one event loop, each carrier just gets its own limit on requests in flight
+    chunks = []
+    for service, numbers in grouped.items():
+        limit = max(limits.get(service, DEFAULT_CONCURRENCY), 1)
+        ensure_pool_size(service, limit)
+
+        semaphore, size = asyncio.Semaphore(limit), get_carrier(service).BATCH_SIZE
+        chunks += [track_chunk(service, numbers[index:index + size], semaphore) for index in range(0, len(numbers), size)]
+
+    results: dict[str, Package | StatusNotAvailable] = dict(resolved)
+    try:
+        for result in await asyncio.gather(*chunks):
+            results |= result
 
-    return "USPS"
+    finally:
+        await asyncio.to_thread(cache.flush)
 
-def track_package(tracking_number: str) -> Package:
-    return {"UPS": UPSTracking, "USPS": USPSTracking}[get_service(tracking_number)].track_package(tracking_number)
+    return {tracking_number: results[tracking_number] for tracking_number in tracking_numbers}
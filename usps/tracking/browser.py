@@ -0,0 +1,77 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import atexit
+from threading import RLock, Timer
+from contextlib import contextmanager
+from collections.abc import Iterator
+
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+
+from usps.tracking import USER_AGENT
+
+# How long (in seconds) an unused browser is kept alive before it gets shut down
+BROWSER_IDLE_TIMEOUT = 120
+
+# Main class
+class Browser:
+    def __init__(self, idle_timeout: float = BROWSER_IDLE_TIMEOUT) -> None:
+        self.idle_timeout = idle_timeout
+        self.instance: webdriver.Firefox | None = None
+
+        self.__lock = RLock()
+        self.__timer: Timer | None = None
+
+    def __start(self) -> webdriver.Firefox:
+        options = Options()
+        options.add_argument("--headless")
+
+        # Setup profile with user agent
+        profile = webdriver.FirefoxProfile()
+        profile.set_preference("general.useragent.override", USER_AGENT)
+
+        # Handle instance creation
+        options.profile = profile
+        return webdriver.Firefox(options = options)
+
+    @contextmanager
+    def session(self) -> Iterator[webdriver.Firefox]:
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+
+            if self.instance is None:
+                self.instance = self.__start()
+
+            try:
+                yield self.instance
+
+            except Exception:
+                # Something broke mid-session, so don't trust this instance with the next refresh
+                self.close()
+                raise
+
+            finally:
+                if self.instance is not None:
+                    self.__timer = Timer(self.idle_timeout, self.close)
+                    self.__timer.daemon = True
+                    self.__timer.start()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+            if self.instance is not None:
+                try:
+                    self.instance.quit()
+
+                except Exception:
+                    pass
+
+                self.instance = None
+
+browser = Browser()
+atexit.register(browser.close)
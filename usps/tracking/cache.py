@@ -0,0 +1,67 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import time
+import json
+from threading import Lock
+
+from usps.storage import Database, chunked, database
+from usps.tracking import Package
+
+# How long (in seconds) a cached package stays fresh, based on its state
+# None means the package will never change again and is cached forever
+CACHE_TTLS = {
+    "delivered":            None,
+    "out for delivery":     120,
+    "delivering":           120,
+    "in transit":           600,
+    "on the way":           600,
+}
+DEFAULT_TTL = 300
+
+# Main class
+class TrackingCache:
+    def __init__(self, database: Database) -> None:
+        self.database = database
+        self.pending: dict[str, tuple[float, str, str]] = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def ttl(state: str) -> float | None:
+        return CACHE_TTLS.get(state.strip().lower(), DEFAULT_TTL)
+
+    def get_many(self, tracking_numbers: list[str], max_age: float | None = None) -> dict[str, Package]:
+        now, results = time.time(), {}
+        for chunk in chunked(tracking_numbers):
+            rows = self.database.connection.execute(
+                f"SELECT tracking_number, fetched, state, package FROM cache WHERE tracking_number IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            for tracking_number, fetched, state, package in rows:
+                ttl = max_age if max_age is not None else self.ttl(state)
+                if ttl is None or now - fetched <= ttl:
+                    results[tracking_number] = Package.from_dict(json.loads(package))
+
+        return results
+
+    def get(self, tracking_number: str, max_age: float | None = None) -> Package | None:
+        return self.get_many([tracking_number], max_age).get(tracking_number)
+
+    def put(self, tracking_number: str, package: Package) -> None:
+        with self.lock:
+            self.pending[tracking_number] = (time.time(), package.state, json.dumps(package.to_dict()))
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        if not pending:
+            return
+
+        with self.database.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache (tracking_number, fetched, state, package) VALUES (?, ?, ?, ?)",
+                [(tracking_number, *entry) for tracking_number, entry in pending.items()]
+            )
+
+cache = TrackingCache(database)
@@ -0,0 +1,45 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import asyncio
+from abc import ABC, abstractmethod
+
+from usps.tracking import Package, StatusNotAvailable, tracking_failed
+
+# Main class
+# Every carrier only needs to implement track_package, everything else falls back to it;
+# carriers with a real bulk API or an async client override the rest
+class Carrier(ABC):
+    BATCH_SIZE: int = 1
+
+    @classmethod
+    @abstractmethod
+    def track_package(cls, tracking_number: str) -> Package:
+        ...
+
+    @classmethod
+    def track_packages(cls, tracking_numbers: list[str]) -> dict[str, Package | StatusNotAvailable]:
+        results = {}
+        for tracking_number in tracking_numbers:
+            try:
+                results[tracking_number] = cls.track_package(tracking_number)
+
+            except StatusNotAvailable as failure:
+                results[tracking_number] = failure
+
+            except Exception as error:  # Keep going with the rest of the batch
+                results[tracking_number] = tracking_failed(error)
+
+        return results
+
+    @classmethod
+    async def track_package_async(cls, tracking_number: str) -> Package:
+        result = (await cls.track_packages_async([tracking_number]))[tracking_number]
+        if isinstance(result, StatusNotAvailable):
+            raise result
+
+        return result
+
+    @classmethod
+    async def track_packages_async(cls, tracking_numbers: list[str]) -> dict[str, Package | StatusNotAvailable]:
+        return await asyncio.to_thread(cls.track_packages, tracking_numbers)
@@ -0,0 +1,46 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import re
+
+# Formats
+UPS_PATTERNS = [r"^1Z[A-Z0-9]{6}[0-9]{10}$"]
+USPS_PATTERNS = [
+    r"^[0-9]{20,22}$",                          # IMpb (and the older 20 digit barcodes)
+    r"^420[0-9]{5}(?:[0-9]{4})?[0-9]{20,22}$",  # IMpb with the routing ZIP code still attached
+    r"^[A-Z]{2}[0-9]{9}[A-Z]{2}$"               # S10 (international)
+]
+
+S10_WEIGHTS = (8, 6, 4, 2, 3, 5, 9, 7)
+
+# Handle cleanup
+def normalize(tracking_number: str) -> str:
+    return re.sub(r"[\s-]", "", tracking_number).upper()
+
+# Check digits
+def ups_checksum(tracking_number: str) -> bool:
+    total = 0
+    for index, character in enumerate(tracking_number[2:17]):
+        value = int(character) if character.isdigit() else (ord(character) - ord("A") + 2) % 10
+        total += value * (2 if index % 2 else 1)
+
+    return (10 - total % 10) % 10 == int(tracking_number[17])
+
+def mod10_checksum(digits: str) -> bool:
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+def usps_checksum(tracking_number: str) -> bool:
+    if tracking_number[:2].isalpha():
+        total = sum(int(digit) * weight for digit, weight in zip(tracking_number[2:10], S10_WEIGHTS))
+        check = 11 - total % 11
+        return {10: 0, 11: 5}.get(check, check) == int(tracking_number[10])
+
+    # Anything longer than a plain barcode still has the 420 + ZIP routing prefix on it
+    if len(tracking_number) > 22:
+        return any(
+            mod10_checksum(tracking_number[offset:])
+            for offset in (8, 12) if 20 <= len(tracking_number) - offset <= 22
+        )
+
+    return mod10_checksum(tracking_number)
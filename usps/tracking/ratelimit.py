@@ -0,0 +1,93 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import time
+from threading import Lock
+
+from usps.metrics import metrics
+
+# Main class
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = burst, time.monotonic()
+        self.lock = Lock()
+
+        # Metrics for tuning the limits
+        self.requests, self.waited, self.max_wait = 0, 0.0, 0.0
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+            self.updated = now
+
+            # Take the token right away (even into debt) so every caller gets its own slot
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, 0)
+
+            self.requests += 1
+            self.waited += wait
+            self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait:
+            metrics.observe("ratelimit.wait", wait)
+            time.sleep(wait)
+
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self.reserve()
+        if wait:
+            import asyncio
+
+            metrics.observe("ratelimit.wait", wait)
+            await asyncio.sleep(wait)
+
+        return wait
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "requests": self.requests,
+                "waited": self.waited,
+                "average_wait": self.waited / self.requests if self.requests else 0.0,
+                "max_wait": self.max_wait
+            }
+
+# Requests per second (and burst size) allowed for each carrier host
+RATE_LIMITS: dict[str, TokenBucket] = {
+    "tools.usps.com":   TokenBucket(2, 5),
+    "www.ups.com":      TokenBucket(5, 10),
+    "webapis.ups.com":  TokenBucket(5, 10),
+}
+CARRIER_HOSTS = {
+    "USPS": ["tools.usps.com"],
+    "UPS": ["www.ups.com", "webapis.ups.com"],
+}
+
+def configure_rate_limit(host: str, rate: float, burst: float | None = None) -> None:
+    if rate <= 0 or (burst is not None and burst <= 0):
+        raise ValueError("Rate limits need a positive rate and burst size")
+
+    RATE_LIMITS[host] = TokenBucket(rate, burst if burst is not None else max(rate, 1))
+
+def configure_carrier_rate_limit(service: str, rate: float, burst: float | None = None) -> None:
+    for host in CARRIER_HOSTS[service]:
+        configure_rate_limit(host, rate, burst)
+
+def wait_for_host(host: str | None) -> float:
+    bucket = RATE_LIMITS.get(host or "")
+    return bucket.acquire() if bucket is not None else 0.0
+
+async def wait_for_host_async(host: str | None) -> float:
+    bucket = RATE_LIMITS.get(host or "")
+    return await bucket.acquire_async() if bucket is not None else 0.0
+
+def rate_limit_stats() -> dict[str, dict[str, float]]:
+    return {host: bucket.stats() for host, bucket in RATE_LIMITS.items()}
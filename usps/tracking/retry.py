@@ -0,0 +1,61 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import time
+import random
+from threading import Lock
+from dataclasses import dataclass
+
+# Typing
+@dataclass(frozen = True)
+class RetryPolicy:
+    attempts:   int = 4         # Total attempts per request, including the first one
+    base_delay: float = 0.5     # Delay before the first retry, doubling after that
+    max_delay:  float = 8       # Upper bound for any single delay
+    jitter:     float = 0.5     # Randomize each delay by up to this fraction
+    timeout:    float = 10      # Timeout for each individual request
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def wait(self, attempt: int) -> None:
+        if attempt:
+            time.sleep(self.delay(attempt))
+
+    async def wait_async(self, attempt: int) -> None:
+        if attempt:
+            import asyncio
+            await asyncio.sleep(self.delay(attempt))
+
+def retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+# Handle failing carriers
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, cooldown: float = 60) -> None:
+        self.threshold, self.cooldown = threshold, cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            # Once the cooldown is over, let requests through again to see if the carrier recovered
+            return time.monotonic() - self.opened_at >= self.cooldown
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures, self.opened_at = 0, None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+RETRY_POLICIES = {"UPS": RetryPolicy(), "USPS": RetryPolicy(attempts = 3)}
+CIRCUIT_BREAKERS = {"UPS": CircuitBreaker(), "USPS": CircuitBreaker()}
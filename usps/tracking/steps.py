@@ -0,0 +1,71 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import re
+from datetime import datetime
+from functools import lru_cache
+from collections import Counter
+
+from usps.metrics import metrics
+
+# Step details we couldn't map, keyed by (carrier, details)
+# Long running processes never drain this, so new details stop being recorded once it's full
+UNKNOWN_STEPS: Counter[tuple[str, str]] = Counter()
+MAX_UNKNOWN_STEPS = 1000
+
+# Handle step classification
+class StepClassifier:
+    def __init__(self, carrier: str, mapping: dict[str, str], track_unknown: bool = True) -> None:
+        self.carrier, self.mapping, self.track_unknown = carrier, mapping, track_unknown
+
+        # Longest phrases first, so "arrived at usps regional facility" wins over "arrived at usps facility"
+        self.pattern = re.compile("|".join(re.escape(phrase) for phrase in sorted(mapping, key = len, reverse = True)))
+        self.__lookup = lru_cache(maxsize = 4096)(self.__classify)
+
+    def __classify(self, details: str) -> str | None:
+        lowered = details.lower()
+        segment = lowered.split(", ")[-1]
+        if segment in self.mapping:
+            return self.mapping[segment]
+
+        # Catch prefixed or suffixed variants, preferring whatever is in the last segment
+        match = self.pattern.search(segment) or self.pattern.search(lowered)
+        return self.mapping[match.group(0)] if match is not None else None
+
+    def classify(self, details: str) -> str | None:
+        result = self.__lookup(details)
+        if result is None and self.track_unknown:
+            key = (self.carrier, details)
+            if key in UNKNOWN_STEPS or len(UNKNOWN_STEPS) < MAX_UNKNOWN_STEPS:
+                UNKNOWN_STEPS[key] += 1
+
+            metrics.count("steps.unknown")
+
+        return result
+
+# Handle date parsing
+MONTHS = {
+    month: index + 1 for index, month in enumerate([
+        "january", "february", "march", "april", "may", "june",
+        "july", "august", "september", "october", "november", "december"
+    ])
+}
+
+def parse_step_time(text: str) -> datetime | None:
+    if not text.strip():
+        return None
+
+    # Handles "January 5, 2024, 10:12 am" and "January 5, 2024" without going through strptime
+    try:
+        month_day, year, *rest = text.split(", ")
+        month, day = month_day.split(" ")
+        if not rest:
+            return datetime(int(year), MONTHS[month.lower()], int(day))
+
+        clock, meridiem = rest[0].split(" ")
+        hour, minute = clock.split(":")
+        hour = int(hour) % 12 + (12 if meridiem.lower() == "pm" else 0)
+        return datetime(int(year), MONTHS[month.lower()], int(day), hour, int(minute))
+
+    except (KeyError, ValueError):
+        return datetime.strptime(text, "%B %d, %Y, %I:%M %p" if ":" in text else "%B %d, %Y")
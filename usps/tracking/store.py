@@ -0,0 +1,106 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from usps.tracking import Step
+
+# Sentinels for steps without a time, or with a time that has no timezone attached
+NO_TIME = -2 ** 63
+NO_OFFSET = -2 ** 31
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds = 1)
+
+# Main class
+# Holds the steps of many packages in flat columns instead of one object per step,
+# with step names and locations stored as indexes into a shared string table
+class StepStore:
+    def __init__(self) -> None:
+        self.times, self.offsets = array("q"), array("i")
+        self.details, self.locations = array("I"), array("I")
+
+        self.strings: list[str] = []
+        self.codes: dict[str, int] = {}
+
+        self.spans: dict[str, tuple[int, int]] = {}
+        self.garbage = 0
+
+    def __code(self, string: str) -> int:
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+
+        return code
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.spans
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def put(self, key: str, steps: list[Step]) -> None:
+        self.remove(key)
+        self.spans[key] = (len(self.times), len(steps))
+        for step in steps:
+            time, offset = NO_TIME, NO_OFFSET
+            if step.time is not None:
+                utcoffset = step.time.utcoffset()
+                if utcoffset is not None:
+                    offset = int(utcoffset.total_seconds())
+
+                time = (step.time.replace(tzinfo = None) - EPOCH) // MICROSECOND
+
+            self.times.append(time)
+            self.offsets.append(offset)
+            self.details.append(self.__code(step.details))
+            self.locations.append(self.__code(step.location))
+
+    def get(self, key: str) -> list[Step] | None:
+        if key not in self.spans:
+            return None
+
+        start, length = self.spans[key]
+        steps = []
+        for index in range(start, start + length):
+            time, offset = self.times[index], self.offsets[index]
+            if time != NO_TIME:
+                time = EPOCH + time * MICROSECOND
+                if offset != NO_OFFSET:
+                    time = time.replace(tzinfo = timezone(timedelta(seconds = offset)))
+
+            steps.append(Step(
+                self.strings[self.details[index]],
+                self.strings[self.locations[index]],
+                time if time != NO_TIME else None
+            ))
+
+        return steps
+
+    def remove(self, key: str) -> None:
+        span = self.spans.pop(key, None)
+        if span is None:
+            return
+
+        # Replaced steps are left in place until enough of them pile up to be worth compacting
+        self.garbage += span[1]
+        if self.garbage > 1024 and self.garbage > len(self.times) // 2:
+            self.compact()
+
+    def compact(self) -> None:
+        times, offsets, details, locations = array("q"), array("i"), array("I"), array("I")
+        for key, (start, length) in self.spans.items():
+            self.spans[key] = (len(times), length)
+            times.extend(self.times[start:start + length])
+            offsets.extend(self.offsets[start:start + length])
+            details.extend(self.details[start:start + length])
+            locations.extend(self.locations[start:start + length])
+
+        self.times, self.offsets, self.details, self.locations = times, offsets, details, locations
+        self.garbage = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in (self.times, self.offsets, self.details, self.locations))
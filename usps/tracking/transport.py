@@ -0,0 +1,153 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import typing
+from threading import Lock
+from weakref import WeakKeyDictionary
+from urllib.parse import urlsplit
+from dataclasses import dataclass, replace
+
+from usps.tracking import USER_AGENT
+from usps.metrics import metrics
+from usps.tracking.ratelimit import wait_for_host, wait_for_host_async
+
+# Typing
+@dataclass(frozen = True)
+class TransportConfig:
+    pool_size:  int = 10        # Connections kept alive per host
+    http2:      bool = False    # Multiplex requests over a single connection (needs httpx)
+
+# Constants
+# Where each carrier lives, swappable for a local stand-in server when benchmarking offline
+BASE_URLS = {
+    "USPS":     "https://tools.usps.com",
+    "UPS":      "https://www.ups.com",
+    "UPS_API":  "https://webapis.ups.com",
+}
+
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Sec-GPC": "1",
+    "User-Agent": USER_AGENT,
+}
+
+TRANSPORT_CONFIG: dict[str, TransportConfig] = {"UPS": TransportConfig(), "USPS": TransportConfig()}
+
+# None of the clients retry on their own; retrying is left to each carrier's RetryPolicy,
+# so every attempt goes through the rate limiter and gets seen by the circuit breaker
+
+# Handle session creation
+SESSIONS: dict[str, typing.Any] = {}
+SESSIONS_LOCK = Lock()
+
+# Async clients only work on the event loop that created them, so keep a set per loop;
+# clients replaced by configure_transport can still have requests in flight, so they get closed along with the rest
+ASYNC_CLIENTS: WeakKeyDictionary = WeakKeyDictionary()
+RETIRED_CLIENTS: WeakKeyDictionary = WeakKeyDictionary()
+
+def _create_requests_session(config: TransportConfig) -> typing.Any:
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+
+    class RateLimitedAdapter(HTTPAdapter):
+        def send(self, request: typing.Any, *args, **kwargs) -> typing.Any:
+            host = urlsplit(request.url).hostname
+            wait_for_host(host)
+
+            metrics.count(f"requests.{host}")
+            with metrics.timer(f"network.{host}"):
+                return super().send(request, *args, **kwargs)
+
+    session = Session()
+    session.headers.update(DEFAULT_HEADERS)
+
+    adapter = RateLimitedAdapter(pool_connections = config.pool_size, pool_maxsize = config.pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _create_httpx_client(config: TransportConfig) -> typing.Any:
+    try:
+        import httpx
+
+    except ImportError:
+        raise RuntimeError("HTTP/2 support requires httpx, install it with: pip install usps-cli[http2]")
+
+    # The transport owns the connection pool, httpx ignores limits given to the client once there is one
+    return httpx.Client(
+        headers = DEFAULT_HEADERS,
+        follow_redirects = True,
+        transport = httpx.HTTPTransport(http2 = True, limits = httpx.Limits(max_connections = config.pool_size, max_keepalive_connections = config.pool_size)),
+        event_hooks = {"request": [lambda request: wait_for_host(request.url.host), lambda request: metrics.count(f"requests.{request.url.host}")]}
+    )
+
+def _create_async_client(config: TransportConfig) -> typing.Any | None:
+    try:
+        import httpx
+
+    except ImportError:
+        return None
+
+    async def before_request(request: typing.Any) -> None:
+        await wait_for_host_async(request.url.host)
+        metrics.count(f"requests.{request.url.host}")
+
+    return httpx.AsyncClient(
+        headers = DEFAULT_HEADERS,
+        follow_redirects = True,
+        transport = httpx.AsyncHTTPTransport(
+            http2 = config.http2,
+            limits = httpx.Limits(max_connections = config.pool_size, max_keepalive_connections = config.pool_size)
+        ),
+        event_hooks = {"request": [before_request]}
+    )
+
+def get_session(service: str) -> typing.Any:
+    with SESSIONS_LOCK:
+        if service not in SESSIONS:
+            config = TRANSPORT_CONFIG.setdefault(service, TransportConfig())
+            SESSIONS[service] = (_create_httpx_client if config.http2 else _create_requests_session)(config)
+
+        return SESSIONS[service]
+
+def configure_transport(service: str, **changes: typing.Any) -> None:
+    with SESSIONS_LOCK:
+        TRANSPORT_CONFIG[service] = replace(TRANSPORT_CONFIG.get(service, TransportConfig()), **changes)
+
+        # Existing connections were built with the old settings, so start fresh next time
+        session = SESSIONS.pop(service, None)
+        if session is not None:
+            session.close()
+
+        for loop, clients in ASYNC_CLIENTS.items():
+            client = clients.pop(service, None)
+            if client is not None:
+                RETIRED_CLIENTS.setdefault(loop, []).append(client)
+
+def get_async_client(service: str) -> typing.Any | None:
+    import asyncio
+
+    # httpx is installed with the package, but if it has gone missing callers fall back to the blocking session in a thread
+    clients = ASYNC_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    if service not in clients:
+        clients[service] = _create_async_client(TRANSPORT_CONFIG.setdefault(service, TransportConfig()))
+
+    return clients[service]
+
+async def close_async_clients() -> None:
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    clients = [client for client in ASYNC_CLIENTS.pop(loop, {}).values() if client is not None]
+    await asyncio.gather(*(client.aclose() for client in clients + RETIRED_CLIENTS.pop(loop, [])))
+
+def ensure_pool_size(service: str, size: int) -> None:
+    if TRANSPORT_CONFIG.get(service, TransportConfig()).pool_size < size:
+        configure_transport(service, pool_size = size)
+
+def configure_base_url(name: str, url: str) -> None:
+    BASE_URLS[name] = url.rstrip("/")
@@ -1,10 +1,16 @@
 # Copyright (c) 2024 iiPython
 
 # Modules
+import typing
 from datetime import datetime, timedelta
 
+from usps.metrics import metrics
 from usps.timezones import LOCAL_TIMEZONE
-from usps.tracking import SESSION, Package, Step, StatusNotAvailable
+from usps.tracking import Package, Step, StatusNotAvailable
+from usps.tracking.retry import CIRCUIT_BREAKERS, RETRY_POLICIES, retryable
+from usps.tracking.carrier import Carrier
+from usps.tracking.transport import BASE_URLS, get_async_client, get_session
+from usps.tracking.steps import StepClassifier
 
 # Handle mapping
 UPS_MILESTONE_MAPPINGS = {
@@ -14,44 +20,209 @@ UPS_MILESTONE_MAPPINGS = {
     "processing at ups facility": "Processing",
     "out for delivery": "Delivering"
 }
+UPS_MILESTONE_CLASSIFIER = StepClassifier("UPS", UPS_MILESTONE_MAPPINGS, track_unknown = False)
+
+# Largest number of tracking numbers the status API accepts per request
+UPS_BATCH_SIZE = 25
 
 # Main class
-class UPSTracking:
-    _failcount: int = 0
+class UPSTracking(Carrier):
+    BATCH_SIZE: int = UPS_BATCH_SIZE
 
     @staticmethod
     def __map_milestone_name(milestone: str) -> str:
-        return UPS_MILESTONE_MAPPINGS.get(milestone.lower(), milestone)
+        return UPS_MILESTONE_CLASSIFIER.classify(milestone) or milestone
+
+    @staticmethod
+    def __status_request(tracking_numbers: list[str], token: str, timeout: float) -> dict:
+        return {
+            "url": f"{BASE_URLS['UPS_API']}/track/api/Track/GetStatus?loc=en_US",
+            "json": {"Locale": "en_US", "TrackingNumber": tracking_numbers},
+            "headers": {"X-XSRF-TOKEN": token},
+            "timeout": timeout
+        }
+
+    @staticmethod
+    def __read_response(session: typing.Any, result: typing.Any) -> dict | None:
+        # UPS itself is struggling, the token is still good for the next attempt
+        if retryable(result.status_code):
+            return None
+
+        # UPS answers a stale token with either a rejection or a non-JSON error page
+        if result.status_code in (401, 403):
+            session.cookies.pop("X-XSRF-TOKEN-ST", None)
+            return None
 
-    @classmethod
-    def track_package(cls, tracking_number: str) -> Package:
         try:
-            if "X-XSRF-TOKEN-ST" not in SESSION.cookies:
-                SESSION.get("https://www.ups.com/track", timeout = 1)
-
-            response = SESSION.post(
-                "https://webapis.ups.com/track/api/Track/GetStatus?loc=en_US",
-                json = {"Locale": "en_US", "TrackingNumber": [tracking_number]},
-                headers = {
-                    "X-XSRF-TOKEN": SESSION.cookies["X-XSRF-TOKEN-ST"]
-                },
-                timeout = 1
-            ).json()
-        
-        except Exception:  # Too many types for me to care about right now
-            if cls._failcount == 4:
-                raise StatusNotAvailable("API request failed")
-
-            cls._failcount += 1
-            if "X-XSRF-TOKEN-ST":
-                SESSION.cookies.pop("X-XSRF-TOKEN-ST")
-
-            return cls.track_package(tracking_number)
+            return result.json()
 
+        except ValueError:
+            session.cookies.pop("X-XSRF-TOKEN-ST", None)
+            return None
+
+    @staticmethod
+    def __check_response(response: dict | None) -> list[dict]:
+        breaker = CIRCUIT_BREAKERS["UPS"]
+        if response is None:
+            breaker.record_failure()
+            raise StatusNotAvailable("API request failed")
+
+        breaker.record_success()
         if response["statusCode"] != "200":
             raise StatusNotAvailable(response["statusText"])
 
-        data = response["trackDetails"][0]
+        return response["trackDetails"]
+
+    @classmethod
+    def __fetch_token(cls, session: typing.Any, timeout: float) -> str | None:
+        if "X-XSRF-TOKEN-ST" not in session.cookies:
+            session.get(f"{BASE_URLS['UPS']}/track", timeout = timeout)
+
+        return session.cookies.get("X-XSRF-TOKEN-ST")
+
+    @classmethod
+    def __fetch_details(cls, tracking_numbers: list[str]) -> list[dict]:
+        policy = RETRY_POLICIES["UPS"]
+        if not CIRCUIT_BREAKERS["UPS"].allow():
+            raise StatusNotAvailable("UPS is failing right now, try again later")
+
+        session, response = get_session("UPS"), None
+        for attempt in range(policy.attempts):
+            policy.wait(attempt)
+
+            # Getting a token and using it fail for different reasons, so keep them apart
+            try:
+                token = cls.__fetch_token(session, policy.timeout)
+
+            except Exception:  # Too many transport error types between clients to list out
+                continue
+
+            if token is None:
+                continue
+
+            try:
+                result = session.post(**cls.__status_request(tracking_numbers, token, policy.timeout))
+
+            except Exception:  # Transport failed, but the token is still good
+                continue
+
+            response = cls.__read_response(session, result)
+            if response is not None:
+                break
+
+        return cls.__check_response(response)
+
+    @classmethod
+    async def __fetch_token_async(cls, client: typing.Any, timeout: float) -> str | None:
+        if "X-XSRF-TOKEN-ST" not in client.cookies:
+            await client.get(f"{BASE_URLS['UPS']}/track", timeout = timeout)
+
+        return client.cookies.get("X-XSRF-TOKEN-ST")
+
+    @classmethod
+    async def __fetch_details_async(cls, client: typing.Any, tracking_numbers: list[str]) -> list[dict]:
+        policy = RETRY_POLICIES["UPS"]
+        if not CIRCUIT_BREAKERS["UPS"].allow():
+            raise StatusNotAvailable("UPS is failing right now, try again later")
+
+        response = None
+        for attempt in range(policy.attempts):
+            await policy.wait_async(attempt)
+            try:
+                token = await cls.__fetch_token_async(client, policy.timeout)
+
+            except Exception:  # Too many transport error types between clients to list out
+                continue
+
+            if token is None:
+                continue
+
+            try:
+                result = await client.post(**cls.__status_request(tracking_numbers, token, policy.timeout))
+
+            except Exception:  # Transport failed, but the token is still good
+                continue
+
+            response = cls.__read_response(client, result)
+            if response is not None:
+                break
+
+        return cls.__check_response(response)
+
+    @classmethod
+    def __collect_details(cls, tracking_numbers: list[str], details: list[dict]) -> dict[str, Package | StatusNotAvailable]:
+        results = {}
+
+        # Match each result back up with the number it belongs to
+        for position, data in enumerate(details):
+            tracking_number = (data.get("trackingNumber") or "").upper()
+            if tracking_number not in tracking_numbers:
+                if position >= len(tracking_numbers):
+                    continue
+
+                tracking_number = tracking_numbers[position]
+
+            try:
+                results[tracking_number] = cls.parse_details(data)
+
+            except StatusNotAvailable as failure:
+                results[tracking_number] = failure
+
+            except (KeyError, IndexError, TypeError, ValueError):
+                results[tracking_number] = StatusNotAvailable("Failed to parse tracking details")
+
+        for tracking_number in tracking_numbers:
+            results.setdefault(tracking_number, StatusNotAvailable("No tracking details returned"))
+
+        return results
+
+    @classmethod
+    def track_package(cls, tracking_number: str) -> Package:
+        result = cls.track_packages([tracking_number])[tracking_number]
+        if isinstance(result, StatusNotAvailable):
+            raise result
+
+        return result
+
+    @classmethod
+    def track_packages(cls, tracking_numbers: list[str]) -> dict[str, Package | StatusNotAvailable]:
+        results = {}
+        for index in range(0, len(tracking_numbers), UPS_BATCH_SIZE):
+            chunk = tracking_numbers[index:index + UPS_BATCH_SIZE]
+            try:
+                results |= cls.__collect_details(chunk, cls.__fetch_details(chunk))
+
+            except StatusNotAvailable as failure:
+                results |= {tracking_number: failure for tracking_number in chunk}
+
+        return results
+
+    @classmethod
+    async def track_packages_async(cls, tracking_numbers: list[str]) -> dict[str, Package | StatusNotAvailable]:
+        client = get_async_client("UPS")
+        if client is None:
+            return await super().track_packages_async(tracking_numbers)
+
+        results = {}
+        for index in range(0, len(tracking_numbers), UPS_BATCH_SIZE):
+            chunk = tracking_numbers[index:index + UPS_BATCH_SIZE]
+            try:
+                results |= cls.__collect_details(chunk, await cls.__fetch_details_async(client, chunk))
+
+            except StatusNotAvailable as failure:
+                results |= {tracking_number: failure for tracking_number in chunk}
+
+        return results
+
+    @classmethod
+    def parse_details(cls, data: dict) -> Package:
+        with metrics.timer("parse.ups"):
+            return cls.__parse_details(data)
+
+    @classmethod
+    def __parse_details(cls, data: dict) -> Package:
+        if data.get("errorCode"):
+            raise StatusNotAvailable(data.get("errorText") or f"Tracking failed with error {data['errorCode']}")
 
         # Handle estimated delivery date
         estimated_delivery = None
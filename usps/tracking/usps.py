@@ -1,22 +1,23 @@
 # Copyright (c) 2024 iiPython
 
 # Modules
+import time
+import typing
+import asyncio
+from contextlib import nullcontext
+from threading import Event, Lock, Thread
 from datetime import datetime
+from dataclasses import dataclass
 
-from rich.status import Status
 from selectolax.lexbor import LexborHTMLParser
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.firefox.options import Options
-
 from usps.storage import security
-from usps.tracking import (
-    SESSION, USER_AGENT,
-    Package, Step, StatusNotAvailable
-)
+from usps.metrics import metrics
+from usps.tracking import PROGRESS, Package, Step, StatusNotAvailable, tracking_failed
+from usps.tracking.retry import CIRCUIT_BREAKERS, RETRY_POLICIES, retryable
+from usps.tracking.carrier import Carrier
+from usps.tracking.transport import BASE_URLS, get_async_client, get_session
+from usps.tracking.steps import StepClassifier, parse_step_time
 
 # Handle status mappings
 USPS_STEP_DETAIL_MAPPING = {
@@ -51,109 +52,334 @@ USPS_STEP_DETAIL_MAPPING = {
     "processed through facility":                       "Processed",
     "processed through usps facility":                  "Processed",
     "origin post is preparing shipment":                "Preparing",
-    "shipping label printed at post office":            "Label Printed"
+    "shipping label printed at post office":            "Label Printed",
+    "expected delivery":                                "Delivering"
 }
+USPS_STEP_CLASSIFIER = StepClassifier("USPS", USPS_STEP_DETAIL_MAPPING)
+
+# Handle page extraction
+# Everything we need from the page is collected with one query, then sorted out by class
+USPS_FOUND_CLASSES = {"preshipment-status", "shipping-partner-status", "delivery-attempt-status", "addressee-unknown-status", "current-step"}
+USPS_PAGE_SELECTOR = ", ".join([
+    *(f".{name}" for name in USPS_FOUND_CLASSES),
+    ".red-banner > .banner-header", ".banner-content", ".tb-status",
+    ".date", ".month_year", ".time", ".product_info > li:first-child",
+    ".tb-step:not(.toggle-history-container)"
+])
+USPS_STEP_SELECTOR = ".tb-date, .tb-location, .tb-status-detail"
+
+@dataclass
+class USPSStepRecord:
+    time:       str
+    location:   str | None
+    details:    str
+
+@dataclass
+class USPSPage:
+    found:      bool
+    error:      str | None
+    banner:     str | None
+    status:     str | None
+    date:       str | None
+    month_year: str | None
+    times:      list[str]
+    product:    str | None
+    steps:      list[USPSStepRecord]
+
+def extract_page(html: str) -> USPSPage:
+    page, seen = USPSPage(False, None, None, None, None, None, [], None, []), set()
+    for node in LexborHTMLParser(html).css(USPS_PAGE_SELECTOR):
+
+        # Nodes matching more than one selector come back once per selector
+        if node.mem_id in seen:
+            continue
+
+        seen.add(node.mem_id)
+        classes = set((node.attributes.get("class") or "").split())
+        if classes & USPS_FOUND_CLASSES:
+            page.found = True
+
+        if "tb-step" in classes and "toggle-history-container" not in classes:
+            fields = {}
+            for child in node.css(USPS_STEP_SELECTOR):
+                for name in ("tb-date", "tb-location", "tb-status-detail"):
+                    if name in (child.attributes.get("class") or "").split():
+                        fields.setdefault(name, child)
+
+            page.steps.append(USPSStepRecord(
+                " ".join(line.strip() for line in fields["tb-date"].text().split("\n")[:2] if line.strip()),
+                fields["tb-location"].text(strip = True) if "tb-location" in fields else None,
+                fields["tb-status-detail"].text()
+            ))
+
+        # Everything past here only cares about the first match, just like css_first would
+        if "banner-header" in classes and page.error is None and node.parent is not None \
+                and "red-banner" in (node.parent.attributes.get("class") or "").split():
+            page.error = node.text(strip = True)
+
+        if "banner-content" in classes and page.banner is None:
+            page.banner = node.text(strip = True)
+
+        if "tb-status" in classes and page.status is None:
+            page.status = node.text()
+
+        if "date" in classes and page.date is None:
+            page.date = node.text()
+
+        if "month_year" in classes and page.month_year is None:
+            page.month_year = node.text().split("\n")[0].strip()
+
+        if "time" in classes and not page.times:
+            page.times = node.text(deep = False, strip = True).split(" and ")
+
+        if node.tag == "li" and page.product is None and node.parent is not None \
+                and "product_info" in (node.parent.attributes.get("class") or "").split() \
+                and node.parent.css_first("li").mem_id == node.mem_id:
+            page.product = node.text(strip = True).split(":")[1]
+
+    # The delivery estimate only counts if the date itself is there
+    if page.date is None:
+        page.month_year, page.times = None, []
+
+    return page
+
+# Cookie lifetime handling
+COOKIE_REFRESH_MARGIN = 60      # Refresh cookies this many seconds before they expire
+COOKIE_CHECK_INTERVAL = 600     # How often the background refresher rechecks cookies with no known expiry
+COOKIE_MIN_WAIT = 60            # Never start Firefox more often than this, even if refreshing keeps failing
+COOKIE_REFRESH_NUMBER = "9400100000000000000000"
 
 # Main class
-class USPSTracking:
+class USPSTracking(Carrier):
+    BATCH_SIZE: int = 1
     _cookies: dict = {}
+    _expires: float | None = None
+    _generation: int = 0
+    _lock: Lock = Lock()
 
     @classmethod
-    def __generate_security(cls, url: str) -> str:
-        with Status("[cyan]Generating cookies...", spinner = "arc"):
-            options = Options()
-            options.add_argument("--headless")
-
-            # Setup profile with user agent
-            profile = webdriver.FirefoxProfile()
-            profile.set_preference("general.useragent.override", USER_AGENT)
-    
-            # Handle instance creation
-            options.profile = profile
-            instance = webdriver.Firefox(options = options)
-            instance.get(url)
-
-            # Wait until we can confirm the JS has loaded the new page
-            WebDriverWait(instance, 5).until(
-                expected_conditions.presence_of_element_located((By.CLASS_NAME, "tracking-number"))
-            )
-
-            cls._cookies = {c["name"]: c["value"] for c in instance.get_cookies()}
-            security.save(cls._cookies)
-
-            # Return page source (saves us a request)
-            html = instance.page_source
-            instance.quit()
-            return html
+    def __load_security(cls) -> None:
+        cls._cookies, cls._expires = security.load()
 
     @classmethod
-    def track_package(cls, tracking_number: str) -> Package:
+    def security_status(cls) -> tuple[bool, float | None]:
         if not cls._cookies:
-            cls._cookies = security.load()
+            cls.__load_security()
 
-        url = f"https://tools.usps.com/go/TrackConfirmAction?qtc_tLabels1={tracking_number}"
+        return bool(cls._cookies), cls._expires
+
+    @classmethod
+    def cookies_expired(cls, margin: float = 0) -> bool:
+        return cls._expires is not None and time.time() + margin >= cls._expires
+
+    @staticmethod
+    def __status(message: str) -> typing.ContextManager:
+        if not PROGRESS["enabled"]:
+            return nullcontext()
+
+        from rich.status import Status
+        return Status(message, spinner = "arc")
+
+    @classmethod
+    def __generate_security(cls, url: str, generation: int) -> str | None:
+        with cls._lock:
+            # If somebody else refreshed the cookies while we were waiting, just use theirs
+            if generation != cls._generation:
+                return None
+
+            # Selenium takes a good while to import, so hold off until we actually need a browser
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support import expected_conditions
+            from selenium.webdriver.support.ui import WebDriverWait
+
+            from usps.tracking.browser import browser
+
+            metrics.count("cookies.generated")
+            with cls.__status("[cyan]Generating cookies..."), metrics.timer("cookies"), browser.session() as instance:
+                instance.get(url)
+
+                # Wait until we can confirm the JS has loaded the new page
+                WebDriverWait(instance, 5).until(
+                    expected_conditions.presence_of_element_located((By.CLASS_NAME, "tracking-number"))
+                )
+
+                security.save(instance.get_cookies())
+                cls._cookies, cls._expires = security.load()
+                cls._generation += 1
+
+                # Return page source (saves us a request)
+                return instance.page_source
+
+    @classmethod
+    def __get(cls, url: str) -> str:
+        policy, breaker = RETRY_POLICIES["USPS"], CIRCUIT_BREAKERS["USPS"]
+        if not breaker.allow():
+            raise StatusNotAvailable("USPS is failing right now, try again later")
+
+        session = get_session("USPS")
+        session.cookies.update(cls._cookies)
+        for attempt in range(policy.attempts):
+            policy.wait(attempt)
+            try:
+                response = session.get(url, timeout = policy.timeout)
+
+            except Exception:  # Too many transport error types between clients to list out
+                continue
+
+            if not retryable(response.status_code):
+                breaker.record_success()
+                return response.text
+
+        breaker.record_failure()
+        raise StatusNotAvailable("Failed to fetch tracking page")
+
+    @classmethod
+    async def __get_async(cls, client: typing.Any, url: str) -> str:
+        policy, breaker = RETRY_POLICIES["USPS"], CIRCUIT_BREAKERS["USPS"]
+        if not breaker.allow():
+            raise StatusNotAvailable("USPS is failing right now, try again later")
 
-        # Load data from page
+        client.cookies.update(cls._cookies)
+        for attempt in range(policy.attempts):
+            await policy.wait_async(attempt)
+            try:
+                response = await client.get(url, timeout = policy.timeout)
+
+            except Exception:  # Too many transport error types between clients to list out
+                continue
+
+            if not retryable(response.status_code):
+                breaker.record_success()
+                return response.text
+
+        breaker.record_failure()
+        raise StatusNotAvailable("Failed to fetch tracking page")
+
+    @classmethod
+    async def __fetch_page_async(cls, client: typing.Any, url: str) -> str:
+        for _ in range(2):
+            generation = cls._generation
+            if cls._cookies and not cls.cookies_expired():
+                response = await cls.__get_async(client, url)
+                if "originalHeaders" not in response:
+                    return response
+
+            # Selenium only has a blocking API, so keep it off the event loop
+            html = await asyncio.to_thread(cls.__generate_security, url, generation)
+            if html is not None:
+                return html
+
+        raise StatusNotAvailable("Failed to generate security cookies")
+
+    @classmethod
+    def __fetch_page(cls, url: str) -> str:
+        for _ in range(2):
+            generation = cls._generation
+            if cls._cookies and not cls.cookies_expired():
+                response = cls.__get(url)
+                if "originalHeaders" not in response:
+                    return response
+
+            html = cls.__generate_security(url, generation)
+            if html is not None:
+                return html
+
+        raise StatusNotAvailable("Failed to generate security cookies")
+
+    @staticmethod
+    def tracking_url(tracking_number: str) -> str:
+        return f"{BASE_URLS['USPS']}/go/TrackConfirmAction?qtc_tLabels1={tracking_number}"
+
+    @classmethod
+    def refresh_security(cls, force: bool = False) -> bool:
         if not cls._cookies:
-            tree = LexborHTMLParser(cls.__generate_security(url))
+            cls.__load_security()
 
-        else:
-            response = SESSION.get(url, cookies = cls._cookies).text
-            tree = LexborHTMLParser(response if "originalHeaders" not in response else cls.__generate_security(url))
+        if cls._cookies and not force and not cls.cookies_expired(COOKIE_REFRESH_MARGIN):
+            return False
 
-        if not tree.any_css_matches((  # pyright: ignore
-            ".preshipment-status", ".shipping-partner-status", ".delivery-attempt-status", ".addressee-unknown-status", ".current-step"
-        )):
-            raise StatusNotAvailable(tree.css_first(".red-banner > .banner-header").text(strip = True))
+        return cls.__generate_security(cls.tracking_url(COOKIE_REFRESH_NUMBER), cls._generation) is not None
 
-        # Start fetching data
-        has_estimated_date = tree.css_matches(".date")
-        month, year = tree.css_first(".month_year").text().split("\n")[0].strip().split(" ") if has_estimated_date else ["", ""]
+    @classmethod
+    def refresh_in_background(cls) -> Event:
+        stop = Event()
 
-        # Figure out delivery times
-        times = tree.css_first(".time").text(deep = False, strip = True).split(" and ") if has_estimated_date else []
+        def refresher() -> None:
+            while not stop.is_set():
+                wait = COOKIE_CHECK_INTERVAL
+                try:
+                    cls.refresh_security()
+                    if cls._expires is not None:
+                        wait = min(max(cls._expires - COOKIE_REFRESH_MARGIN - time.time(), COOKIE_MIN_WAIT), COOKIE_CHECK_INTERVAL)
 
-        # Fetch steps
-        steps = []
-        for step in tree.css(".tb-step:not(.toggle-history-container)"):
-            time = " ".join(line.strip() for line in step.css_first(".tb-date").text().split("\n")[:2] if line.strip())
+                except Exception:  # Selenium can fail in plenty of ways, the next track will just retry
+                    pass
 
-            location = None
-            if step.css_matches(".tb-location"):
-                location = step.css_first(".tb-location").text(strip = True)
+                stop.wait(wait)
 
-            details = step.css_first(".tb-status-detail").text()
-            if details.lower() == "reminder to schedule redelivery of your item":
-                location = "SCHEDULE REDELIVERY"
+        Thread(target = refresher, daemon = True).start()
+        return stop
 
-            detail_mapping = details.split(", ")[-1].lower()
-            if detail_mapping not in USPS_STEP_DETAIL_MAPPING:
-                print(f"Missing step mapping! Post this on GitHub: \"{detail_mapping}\" / \"{details}\"")
+    @classmethod
+    def parse_page(cls, html: str) -> Package:
+        with metrics.timer("parse.usps"):
+            return cls.__build_package(extract_page(html))
+
+    @classmethod
+    def __build_package(cls, page: USPSPage) -> Package:
+        if not page.found:
+            raise StatusNotAvailable(page.error or "Tracking information is not available.")
+
+        # Fetch steps
+        steps = []
+        for step in page.steps:
+            location = step.location
+            if step.details.lower() == "reminder to schedule redelivery of your item":
+                location = "SCHEDULE REDELIVERY"
 
             steps.append(Step(
-                USPS_STEP_DETAIL_MAPPING.get(detail_mapping, "Unknown")
-                        if "expected delivery" not in detail_mapping.lower() else "Delivering",
+                USPS_STEP_CLASSIFIER.classify(step.details) or "Unknown",
                 location or "",
-                datetime.strptime(
-                    time,
-                    "%B %d, %Y, %I:%M %p" if ":" in time else "%B %d, %Y"
-                ) if time.strip() else None
+                parse_step_time(step.time)
             ))
 
-        postal_product = tree.css_first(".product_info > li:first-child")
-        if postal_product is not None:
-            postal_product = postal_product.text(strip = True).split(":")[1]
+        # Figure out delivery times
+        expected = None
+        if page.date is not None:
+            month, year = page.month_year.split(" ")
+            expected = [
+                datetime.strptime(f"{page.date.zfill(2)} {month} {year} {time.strip()}", "%d %B %Y %I:%M%p")
+                for time in page.times
+            ]
 
-        return Package(
-            [
-                datetime.strptime(
-                    f"{tree.css_first('.date').text().zfill(2)} {month} {year} {time.strip()}",
-                    "%d %B %Y %I:%M%p"
-                )
-                for time in times
-            ] if has_estimated_date else None,
-            tree.css_first(".banner-content").text(strip = True),
-            tree.css_first(".tb-status").text(),
-            steps,
-            postal_product
-        )
+        return Package(expected, page.banner, page.status, steps, page.product)
+
+    @classmethod
+    def track_package(cls, tracking_number: str) -> Package:
+        if not cls._cookies:
+            cls.__load_security()
+
+        return cls.parse_page(cls.__fetch_page(cls.tracking_url(tracking_number)))
+
+    @classmethod
+    async def track_package_async(cls, tracking_number: str) -> Package:
+        client = get_async_client("USPS")
+        if client is None:
+            return await asyncio.to_thread(cls.track_package, tracking_number)
+
+        if not cls._cookies:
+            cls.__load_security()
+
+        return cls.parse_page(await cls.__fetch_page_async(client, cls.tracking_url(tracking_number)))
+
+    @classmethod
+    async def track_packages_async(cls, tracking_numbers: list[str]) -> dict[str, Package | StatusNotAvailable]:
+        results = await asyncio.gather(*[cls.track_package_async(tracking_number) for tracking_number in tracking_numbers], return_exceptions = True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result    # Cancellation and friends still need to go through
+
+        return {
+            tracking_number: tracking_failed(result) if isinstance(result, Exception) and not isinstance(result, StatusNotAvailable) else result
+            for tracking_number, result in zip(tracking_numbers, results)
+        }
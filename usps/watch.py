@@ -0,0 +1,112 @@
+# Copyright (c) 2024 iiPython
+
+# Modules
+import time
+import heapq
+from dataclasses import replace
+
+from usps.tracking import Package, StatusNotAvailable, iter_packages
+from usps.tracking.store import StepStore
+
+# How often (in seconds) a package gets polled based on its state, None means never again
+WATCH_INTERVALS = {
+    "delivered":            None,
+    "out for delivery":     300,
+    "delivering":           300,
+    "in transit":           3600,
+    "on the way":           3600,
+}
+DEFAULT_WATCH_INTERVAL = 1800
+
+# Packages that haven't changed in a while get polled up to this many times less often
+MAX_IDLE_MULTIPLIER = 4
+
+# Backoff for packages that keep failing to track
+FAILURE_BACKOFF = 300
+MAX_FAILURE_BACKOFF = 6 * 3600
+
+# Main class
+class Watcher:
+    def __init__(self, concurrency: dict[str, int] | None = None) -> None:
+        self.concurrency = concurrency
+        self.queue: list[tuple[float, str]] = []
+        self.results: dict[str, Package | StatusNotAvailable] = {}
+        self.steps = StepStore()    # Steps for everything in results, which only keeps empty step lists
+
+        self.failures: dict[str, int] = {}
+        self.unchanged: dict[str, int] = {}
+        self.scheduled: dict[str, float] = {}
+
+    def sync(self, tracking_numbers: list[str]) -> None:
+        now = time.time()
+        for tracking_number in tracking_numbers:
+            if tracking_number not in self.scheduled and tracking_number not in self.results:
+                self.__schedule(tracking_number, now)
+
+        # Anything removed from the package list just gets skipped when it comes due
+        for tracking_number in (set(self.scheduled) | set(self.results)) - set(tracking_numbers):
+            for mapping in (self.scheduled, self.results, self.failures, self.unchanged):
+                mapping.pop(tracking_number, None)
+
+            self.steps.remove(tracking_number)
+
+    def __schedule(self, tracking_number: str, when: float) -> None:
+        self.scheduled[tracking_number] = when
+        heapq.heappush(self.queue, (when, tracking_number))
+
+    def interval(self, tracking_number: str) -> float | None:
+        result = self.results[tracking_number]
+        if isinstance(result, StatusNotAvailable):
+            return min(FAILURE_BACKOFF * 2 ** (self.failures[tracking_number] - 1), MAX_FAILURE_BACKOFF)
+
+        interval = WATCH_INTERVALS.get(result.state.strip().lower(), DEFAULT_WATCH_INTERVAL)
+        if interval is None:
+            return None
+
+        return interval * min(2 ** self.unchanged.get(tracking_number, 0), MAX_IDLE_MULTIPLIER)
+
+    def next_poll(self) -> float | None:
+        while self.queue and self.scheduled.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+
+        return self.queue[0][0] if self.queue else None
+
+    def poll(self) -> list[tuple[str, Package | StatusNotAvailable]]:
+        now, due = time.time(), []
+        while self.queue and self.queue[0][0] <= now:
+            when, tracking_number = heapq.heappop(self.queue)
+            if self.scheduled.get(tracking_number) == when:
+                del self.scheduled[tracking_number]
+                due.append(tracking_number)
+
+        changed = []
+        for tracking_number, result in iter_packages(due, self.concurrency):
+            previous = self.results.get(tracking_number)
+            if isinstance(previous, Package):
+                previous = replace(previous, steps = self.steps.get(tracking_number))
+
+            if isinstance(result, Package):
+                self.results[tracking_number] = replace(result, steps = [])
+                self.steps.put(tracking_number, result.steps)
+
+            else:
+                self.results[tracking_number] = result
+                self.steps.remove(tracking_number)
+
+            if isinstance(result, StatusNotAvailable):
+                self.failures[tracking_number] = self.failures.get(tracking_number, 0) + 1
+                is_changed = not isinstance(previous, StatusNotAvailable) or str(previous) != str(result)
+
+            else:
+                self.failures.pop(tracking_number, None)
+                is_changed = result != previous
+
+            self.unchanged[tracking_number] = 0 if is_changed else self.unchanged.get(tracking_number, 0) + 1
+            if is_changed:
+                changed.append((tracking_number, result))
+
+            interval = self.interval(tracking_number)
+            if interval is not None:
+                self.__schedule(tracking_number, time.time() + interval)
+
+        return changed